@@ -0,0 +1,25 @@
+# The library in one import, without the demo of main.py:
+#   from api import *
+# Importing it builds nothing and runs nothing. qiskit_aer is only loaded by select_backend, when it
+# picks an Aer method, so circuit construction and the basis-state simulator never pay for it.
+# Code that only needs part of the library (e.g. the batch workers) should import that module directly.
+
+## CIRCUIT CONSTRUCTION
+from registers import *
+from utilities import *
+from gates import *
+from functions import *
+from peephole import *
+from resources import *
+from cache import *
+from order_finding import order_finding_circuit, order_from_measurement, reduce_order, find_order
+
+## BACKEND EXECUTION
+from basis_state import BasisStateSimulator, simulate, register_values, register_state
+from backends import *
+from batch import *
+
+## TOOLS
+from benchmark import run_benchmarks, compare_to_baseline
+from profiler import Profiler, format_profile
+from runner import run_jobs
@@ -0,0 +1,141 @@
+from math import inf, log2
+import psutil
+from qiskit.circuit import ControlledGate
+from basis_state import BasisStateSimulator, _compile
+
+# Picks how to simulate a circuit from its size and gate set, before anything is allocated.
+# The estimates are upper bounds in bytes, inf when the method cannot run the circuit:
+#  - basis_state: one bit per qubit, only for X/MCX/SWAP/reset circuits (see basis_state.py)
+#  - statevector: 2^q complex amplitudes
+#  - matrix_product_state: 2 chi^2 complex numbers per qubit, see _chi_log2 for the bound on chi
+#  - extended_stabilizer: about q^2 bytes per stabilizer state, 2^(0.23 t) states for t T-like gates;
+#    it is approximate, so select_method only picks it when asked to
+
+METHODS = ["basis_state", "statevector", "matrix_product_state", "extended_stabilizer"]
+
+CLIFFORD_GATES = {"x", "y", "z", "h", "s", "sdg", "cx", "cz", "swap", "reset", "measure", "barrier"}
+EXACT_METHODS = ["basis_state", "statevector", "matrix_product_state"]
+
+# gates that map a basis state to a basis state times a phase
+DIAGONAL_GATES = {"z", "s", "sdg", "t", "tdg", "p", "rz", "u1", "cz", "cp", "crz", "cu1", "mcphase", "mcp", "mcu1", "ccz"}
+
+
+def is_basis_state_circuit(circuit):
+    # True if basis states stay basis states all along, so the basis-state simulator can run it
+    try:
+        _compile(circuit)
+    except ValueError:
+        return False
+    return True
+
+
+def _t_count(circuit):
+    # T gates needed by the non-Clifford gates, 7 per Toffoli; every other rotation counts as one
+    t = 0
+    for instruction in circuit.data:
+        operation = instruction.operation
+        if operation.name in CLIFFORD_GATES:
+            continue
+        if isinstance(operation, ControlledGate) and operation.base_gate.name == "x":
+            t += 7 * (operation.num_ctrl_qubits - 1)
+        else:
+            t += 1
+    return t
+
+
+def _bytes(log2_bytes):
+    return inf if log2_bytes > 1000 else 2.0**log2_bytes
+
+
+def _chi_log2(circuit):
+    # log2 of a bound on the bond dimension of the MPS across any cut, whatever the order of the qubits.
+    # A qubit is classical while it is known to hold a basis state, not entangled with anything: X gates,
+    # X gates with classical controls, SWAP gates and diagonal gates keep it so, and a reset or a measurement
+    # makes it classical again (the MPS method follows one shot at a time). Other gates make their qubits quantum.
+    # Only quantum qubits carry entanglement, so chi <= 2^(half of them); and a gate acting on two quantum
+    # qubits or more multiplies chi by at most 2 if it is controlled or diagonal, 4 per pair of qubits otherwise.
+    quantum = set()
+    chi_log2 = 0
+    gates_log2 = 0
+    for instruction in circuit.data:
+        operation = instruction.operation
+        qubits = [circuit.find_bit(qubit).index for qubit in instruction.qubits]
+        if operation.name == "barrier":
+            continue
+        if operation.name in ("reset", "measure"):
+            quantum.difference_update(qubits)
+            continue
+
+        is_controlled_x = isinstance(operation, ControlledGate) and operation.base_gate.name == "x"
+        if operation.name == "x" or is_controlled_x and not quantum.intersection(qubits[:operation.num_ctrl_qubits]):
+            continue # X on the target or nothing, its status does not change
+        if operation.name == "swap":
+            a, b = qubits
+            if (a in quantum) != (b in quantum):
+                quantum.symmetric_difference_update(qubits) # the state of the quantum one moves
+            touched = [qubit for qubit in qubits if qubit in quantum]
+            rank_log2 = 2
+        elif operation.name in DIAGONAL_GATES:
+            touched = [qubit for qubit in qubits if qubit in quantum] # a classical qubit only adds a phase
+            rank_log2 = 1
+        else:
+            touched = qubits
+            rank_log2 = 1 if isinstance(operation, ControlledGate) else 2 * (len(qubits) // 2)
+
+        quantum.update(touched)
+        if len(touched) > 1:
+            gates_log2 += rank_log2
+        chi_log2 = max(chi_log2, min(gates_log2, len(quantum) // 2))
+
+    return chi_log2
+
+
+def memory_estimates(circuit):
+    # {method: estimated bytes} for every method in METHODS
+    q = circuit.num_qubits
+    basis_state = is_basis_state_circuit(circuit)
+    chi_log2 = _chi_log2(circuit)
+
+    return {
+        "basis_state": q / 8 if basis_state else inf,
+        "statevector": _bytes(q + 4),
+        "matrix_product_state": _bytes(log2(q) + 5 + 2 * chi_log2) if q else 0,
+        "extended_stabilizer": _bytes(0.23 * _t_count(circuit) + 2 * log2(q)) if q else 0,
+    }
+
+
+def select_method(circuit, memory_limit=None, approximate=False):
+    # the first method in EXACT_METHODS whose estimate fits in memory_limit bytes (the available memory by default),
+    # then extended_stabilizer if approximate is set
+    if memory_limit is None:
+        memory_limit = psutil.virtual_memory().available
+
+    estimates = memory_estimates(circuit)
+    for method in (METHODS if approximate else EXACT_METHODS):
+        if estimates[method] <= memory_limit:
+            return method, estimates
+
+    raise MemoryError(f"no simulation method fits in {memory_limit} bytes: {format_estimates(estimates)}")
+
+
+def format_estimates(estimates):
+    def size(value):
+        if value == inf:
+            return "unavailable" # cannot run the circuit, or more bytes than a float holds
+        return f"{value / 2**20:.3g} MiB"
+    return ", ".join(f"{method} {size(value)}" for method, value in estimates.items())
+
+
+def select_backend(circuit, memory_limit=None, report=True, approximate=False):
+    # A backend for circuit (as built, before transpile), see select_method
+    method, estimates = select_method(circuit, memory_limit=memory_limit, approximate=approximate)
+
+    if report:
+        print(f"Memory estimates: {format_estimates(estimates)}")
+        print(f"Using {method}")
+
+    if method == "basis_state":
+        return BasisStateSimulator()
+
+    from qiskit_aer import AerSimulator # only loaded when a circuit needs it
+    return AerSimulator(method=method)
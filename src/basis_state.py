@@ -0,0 +1,147 @@
+import numpy as np
+from qiskit import QuantumCircuit
+from qiskit.circuit import ControlledGate
+
+# Classical simulator for circuits made only of X, multi-controlled X (open controls too), SWAP, reset and measure,
+# i.e. everything the ripple and cuccaro adders build, started from computational basis states.
+# Each qubit is a row of booleans with one column per input, so a whole batch of inputs goes through
+# the circuit with one NumPy operation per gate instead of a 2^q statevector.
+# rx(theta) is accepted for theta = 0 or pi, the values set_bits_parameterized is bound to.
+
+
+def _compile(circuit):
+    # the instructions as (kind, qubit indices, clbit indices, operation), checked once per circuit
+    instructions = []
+    for instruction in circuit.data:
+        operation = instruction.operation
+        qubits = [circuit.find_bit(qubit).index for qubit in instruction.qubits]
+        clbits = [circuit.find_bit(clbit).index for clbit in instruction.clbits]
+
+        if operation.name == "x":
+            kind = "x"
+        elif isinstance(operation, ControlledGate) and operation.base_gate.name == "x":
+            kind = "mcx"
+        elif operation.name in ("swap", "reset", "measure", "barrier", "rx"):
+            kind = operation.name
+        else:
+            raise ValueError(f"{operation.name} is not supported by the basis-state simulator")
+
+        instructions.append((kind, qubits, clbits, operation))
+
+    return instructions
+
+
+def _flip_mask(angle, batch):
+    # rx(pi)|0> = -i|1>, rx(0)|0> = |0>; anything else leaves the basis
+    angle = np.broadcast_to(np.asarray(angle, dtype=float) % (2 * np.pi), (batch,))
+    if not np.all(np.isclose(angle, 0) | np.isclose(angle, np.pi) | np.isclose(angle, 2 * np.pi)):
+        raise ValueError("rx only supported with angles 0 and pi by the basis-state simulator")
+    return np.isclose(angle, np.pi)
+
+
+def simulate(circuit, initial_state=None, batch=1, parameter_values=None):
+    # Runs circuit on batch inputs at once
+    # initial_state: bool array (num_qubits, batch), all |0> if None
+    # parameter_values: {parameter: array of batch values} for the rx gates
+    # returns (state, clbits): bool arrays (num_qubits, batch) and (num_clbits, batch)
+    if initial_state is None:
+        state = np.zeros((circuit.num_qubits, batch), dtype=bool)
+    else:
+        state = np.array(initial_state, dtype=bool)
+        batch = state.shape[1]
+    clbits = np.zeros((circuit.num_clbits, batch), dtype=bool)
+
+    for kind, qubits, clbit_indices, operation in _compile(circuit):
+        if kind == "x":
+            state[qubits[0]] ^= True
+        elif kind == "mcx":
+            controls = state[qubits[:-1]]
+            if operation.ctrl_state != 2**operation.num_ctrl_qubits - 1:
+                # open controls fire on |0>, see peephole.py
+                open_controls = [(operation.ctrl_state >> j) & 1 == 0 for j in range(operation.num_ctrl_qubits)]
+                controls = controls ^ np.array(open_controls)[:, None]
+            state[qubits[-1]] ^= np.logical_and.reduce(controls, axis=0)
+        elif kind == "swap":
+            state[[qubits[0], qubits[1]]] = state[[qubits[1], qubits[0]]]
+        elif kind == "reset":
+            state[qubits[0]] = False
+        elif kind == "measure":
+            clbits[clbit_indices[0]] = state[qubits[0]]
+        elif kind == "rx":
+            angle = operation.params[0]
+            if hasattr(angle, "parameters") and angle.parameters:
+                angle = parameter_values[angle]
+            state[qubits[0]] ^= _flip_mask(angle, batch)
+
+    return state, clbits
+
+
+def register_values(bits, indices):
+    # ints (LSB = bits[indices[0]]) from a bool array like the ones simulate returns
+    values = np.zeros(bits.shape[1], dtype=np.int64)
+    for j, index in enumerate(indices):
+        values |= bits[index].astype(np.int64) << j
+    return values
+
+
+def register_state(values, width):
+    # the inverse of register_values: bool array (width, len(values))
+    values = np.asarray(values, dtype=np.int64)
+    return np.array([(values >> j) & 1 for j in range(width)], dtype=bool)
+
+
+class BasisStateResult:
+
+    def __init__(self, counts, circuits):
+        self.counts = counts
+        self.circuits = circuits # the circuit each experiment ran, as passed to run
+
+    def get_counts(self, experiment=None):
+        # experiment is an index, a circuit given to run or the name of one, as for the results of AerSimulator:
+        # a circuit is found by identity first, then by name, and the first of its experiments is returned
+        # None returns the counts of the only experiment, or the list of all of them
+        if experiment is None:
+            return self.counts[0] if len(self.counts) == 1 else list(self.counts)
+        if isinstance(experiment, (int, np.integer)) and not isinstance(experiment, bool):
+            return self.counts[experiment]
+
+        if isinstance(experiment, QuantumCircuit):
+            for i, circuit in enumerate(self.circuits):
+                if circuit is experiment:
+                    return self.counts[i]
+            experiment = experiment.name
+        if isinstance(experiment, str):
+            for i, circuit in enumerate(self.circuits):
+                if circuit.name == experiment:
+                    return self.counts[i]
+            raise ValueError(f"no experiment ran a circuit named {experiment}")
+
+        raise ValueError(f"experiment must be an index, a circuit or a circuit name, got {experiment!r}")
+
+    def result(self):
+        # so run() can be used like a backend job
+        return self
+
+
+class BasisStateSimulator:
+    # Drop-in for AerSimulator in run_batch, power_Y_sweep and exhaustive_check for circuits it supports
+    # The circuits are not transpiled for it, see cache.transpile_for
+    name = "basis_state"
+
+    def run(self, circuits, shots=1, parameter_binds=None, **options):
+        if not isinstance(circuits, (list, tuple)):
+            circuits = [circuits]
+
+        counts = []
+        experiment_circuits = []
+        for i, circuit in enumerate(circuits):
+            binds = parameter_binds[i] if parameter_binds else {}
+            batch = len(next(iter(binds.values()))) if binds else 1
+
+            _, clbits = simulate(circuit, batch=batch, parameter_values=binds)
+            for experiment in range(batch):
+                outcome = "".join("1" if bit else "0" for bit in reversed(clbits[:, experiment]))
+                counts.append({outcome: shots})
+                experiment_circuits.append(circuit)
+
+        return BasisStateResult(counts, experiment_circuits)
@@ -0,0 +1,80 @@
+import io
+from concurrent.futures import ProcessPoolExecutor
+from qiskit import qpy
+from cache import *
+
+
+def decode_counts(counts):
+    # the most frequent outcome, as an int
+    return int(max(counts, key=counts.get), 2)
+
+
+def _build_and_transpile_qpy(task):
+    # runs in a worker process, the circuit goes back to the parent as QPY
+    N, X, Y, backend, mode = task
+    core = transpile_for(build_power_Y_core(N, X, Y, **mode), backend)
+
+    buffer = io.BytesIO()
+    qpy.dump(core, buffer)
+    return buffer.getvalue()
+
+
+def build_and_transpile_parallel(parameter_sets, backend, workers=None, reset_free=False, adder="ripple", constant=False, window=1, reduction="doubling", optimize=False, gate_library="standard"):
+    # Builds and transpiles the core of every (n, x, y) in parameter_sets in a pool of worker processes
+    # workers=None uses one process per CPU
+    # returns the transpiled cores, in the same order as parameter_sets
+    mode = {"reset_free": reset_free, "adder": adder, "constant": constant, "window": window, "reduction": reduction, "optimize": optimize, "gate_library": gate_library}
+    tasks = [(n, x, y, backend, mode) for n, x, y in parameter_sets]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return [qpy.load(io.BytesIO(data))[0] for data in executor.map(_build_and_transpile_qpy, tasks)]
+
+
+def run_batch(inputs, backend, cache=None, shots=1, reset_free=False, adder="ripple", constant=False, window=1, reduction="doubling", optimize=False, gate_library="standard", workers=1):
+    # Computes b * x^y mod n for every (b, n, x, y) in inputs (ints or binary strings, see registers.py; b as wide as n):
+    # the circuits missing from the cache are transpiled in a single call and all of them are
+    # submitted in a single backend.run, so the simulator can run them in parallel
+    # with workers other than 1 the missing cores are also built in parallel, see build_and_transpile_parallel
+    # returns {(b, n, x, y): result as an int}
+    if cache is None:
+        cache = CircuitCache()
+
+    transpiled_cores = {}
+    missing_cores = {} # key -> (n, x, y)
+    for b, n, x, y in inputs:
+        check_width(b, register_width(n), name="b")
+
+        key = power_Y_key(n, x, y, reset_free=reset_free, adder=adder, constant=constant, window=window, reduction=reduction, optimize=optimize, gate_library=gate_library, backend=backend)
+        if key in transpiled_cores or key in missing_cores:
+            continue
+
+        core = cache.get(key)
+        if core is None:
+            missing_cores[key] = (n, x, y)
+        else:
+            transpiled_cores[key] = core
+
+    if missing_cores:
+        keys = list(missing_cores)
+        if workers == 1:
+            cores = transpile_for([build_power_Y_core(*missing_cores[key], reset_free=reset_free, adder=adder, constant=constant, window=window, reduction=reduction, optimize=optimize, gate_library=gate_library) for key in keys], backend)
+        else:
+            cores = build_and_transpile_parallel([missing_cores[key] for key in keys], backend, workers=workers, reset_free=reset_free, adder=adder, constant=constant, window=window, reduction=reduction, optimize=optimize, gate_library=gate_library)
+
+        for key, core in zip(keys, cores):
+            cache.put(key, core)
+            transpiled_cores[key] = core
+
+    circuits = []
+    for b, n, x, y in inputs:
+        key = power_Y_key(n, x, y, reset_free=reset_free, adder=adder, constant=constant, window=window, reduction=reduction, optimize=optimize, gate_library=gate_library, backend=backend)
+        circuits.append(load_B(transpiled_cores[key], b))
+
+    options = {}
+    if hasattr(getattr(backend, "options", None), "max_parallel_experiments"):
+        options["max_parallel_experiments"] = 0 # Aer runs one experiment at a time by default, 0 uses every core
+
+    result = backend.run(circuits, shots=shots, **options).result()
+
+    values = counts_to_ints([result.get_counts(i) for i in range(len(inputs))])
+    return {inputs[i]: int(values[i]) for i in range(len(inputs))}
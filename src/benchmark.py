@@ -0,0 +1,295 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import threading
+import time
+import psutil
+import qiskit
+from qiskit import QuantumCircuit
+from utilities import *
+from functions import *
+from cache import build_power_Y_core, load_B, transpile_for
+from backends import select_backend
+from profiler import Profiler, format_profile
+
+# Benchmarks for the functions in functions.py over register widths n (and exponent widths for the powers).
+# Every point records the wall time to build, transpile and run the circuit, the peak RSS of the process
+# while the point ran, and the qubits, gates and depth of the built circuit. Results are written as JSON and can be
+# compared with a saved baseline:
+#   python benchmark.py --widths 1 2 3 --output results.json --baseline baseline.json
+# The functions run in ripple reset mode with an AncillaAllocator, like build_power_Y_core;
+# multiply_mod_fixed_power_Y also takes the modes of build_power_Y_core.
+# --profile FILE writes where the gates (or the build time, --profile-metric time) of all the builds come from,
+# as collapsed stacks for a flame graph, see profiler.py.
+
+TIME_METRICS = ["build_s", "transpile_s", "run_s"]
+SIZE_METRICS = ["qubits", "gates", "depth"]
+
+
+def _values(n, seed):
+    # an odd N of n bits with the top bit set when possible, and A, B < N (deterministic for n and seed)
+    generator = random.Random(seed * 1000 + n)
+    N = (1 << (n-1)) | generator.randrange(2**n) | 1
+    return N, generator.randrange(N), generator.randrange(N)
+
+
+def _arithmetic(function, n, y_width, seed, gate_library="standard"):
+    # circuit for one call of function on registers of width n, inputs loaded and output measured
+    N_value, A_value, B_value = _values(n, seed)
+    circuit = QuantumCircuit(4*n + 2, n)
+    N, A, B, R = [list(range(i*n, (i+1)*n)) for i in range(4)]
+    control, r = 4*n, 4*n + 1
+    AUX = AncillaAllocator(circuit)
+
+    load_register(circuit=circuit, A=N, value=N_value)
+    load_register(circuit=circuit, A=A, value=A_value)
+    load_register(circuit=circuit, A=B, value=B_value)
+    circuit.x(control)
+
+    if function == "add":
+        add(circuit=circuit, A=A, B=B, R=R, AUX=AUX)
+    elif function == "controlled_add":
+        controlled_add(circuit=circuit, control=control, A=A, B=B, R=R, AUX=AUX, gate_library=gate_library)
+    elif function == "subtract":
+        subtract(circuit=circuit, A=A, B=B, R=R, AUX=AUX)
+    elif function == "controlled_subtract":
+        controlled_subtract(circuit=circuit, control=control, A=A, B=B, R=R, AUX=AUX, gate_library=gate_library)
+    elif function == "greater_than":
+        greater_than(circuit=circuit, A=A, B=B, r=r, AUX=AUX)
+        R = [r] + R[1:]
+    elif function == "greater_than_or_equal":
+        greater_than_or_equal(circuit=circuit, A=A, B=B, r=r, AUX=AUX)
+        R = [r] + R[1:]
+    elif function == "add_mod":
+        add_mod(circuit=circuit, N=N, A=A, B=B, R=R, AUX=AUX, gate_library=gate_library)
+    elif function == "times_two_mod":
+        times_two_mod(circuit=circuit, N=N, A=A, R=R, AUX=AUX, gate_library=gate_library)
+    elif function == "times_two_power_mod":
+        times_two_power_mod(circuit=circuit, N=N, A=A, k=n, R=R, AUX=AUX, gate_library=gate_library)
+    elif function == "multiply_mod":
+        multiply_mod(circuit=circuit, N=N, A=A, B=B, R=R, AUX=AUX, gate_library=gate_library)
+    elif function == "multiply_mod_montgomery":
+        multiply_mod_montgomery(circuit=circuit, N=N, A=A, B=B, R=R, AUX=AUX, gate_library=gate_library)
+    elif function == "multiply_mod_fixed":
+        multiply_mod_fixed(circuit=circuit, N=N, X=A_value, B=B, AUX=AUX, gate_library=gate_library)
+        R = B
+    elif function == "multiply_mod_fixed_power_2_k":
+        multiply_mod_fixed_power_2_k(circuit=circuit, N=N_value, X=A_value, B=B, AUX=AUX, k=y_width-1, gate_library=gate_library)
+        R = B
+    else:
+        raise ValueError(f"no benchmark for {function}")
+
+    circuit.measure(R, range(n))
+    return circuit
+
+
+def _power_Y(n, y_width, seed, mode):
+    N_value, X_value, b_value = _values(n, seed)
+    Y = random.Random(seed).randrange(2**y_width)
+    return load_B(build_power_Y_core(to_binary(N_value, n), X_value, Y, **mode), b_value)
+
+
+FUNCTIONS = ["add", "controlled_add", "subtract", "controlled_subtract", "greater_than", "greater_than_or_equal",
+             "add_mod", "times_two_mod", "times_two_power_mod", "multiply_mod", "multiply_mod_montgomery",
+             "multiply_mod_fixed", "multiply_mod_fixed_power_2_k", "multiply_mod_fixed_power_Y"]
+
+# the functions whose cost depends on the width of the exponent
+EXPONENT_FUNCTIONS = ["multiply_mod_fixed_power_2_k", "multiply_mod_fixed_power_Y"]
+
+
+def _peak_rss_during(call):
+    # (call(), the peak RSS in bytes while call ran), so that a point does not report the peak of the points before it:
+    # on Linux the kernel's high-water mark (VmHWM) is reset to the current RSS before the call,
+    # elsewhere a thread samples the RSS with psutil
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+    except OSError:
+        return _sampled_peak_rss_during(call)
+
+    result = call()
+    with open("/proc/self/status") as file:
+        for line in file:
+            if line.startswith("VmHWM:"):
+                return result, int(line.split()[1]) * 1024 # in kB
+    return result, psutil.Process().memory_info().rss
+
+
+def _sampled_peak_rss_during(call, interval=0.001):
+    # the sampling thread only runs while call releases the GIL, as the simulators do while they run
+    process = psutil.Process()
+    peak = process.memory_info().rss
+    done = threading.Event()
+
+    def sample():
+        nonlocal peak
+        while not done.wait(interval):
+            peak = max(peak, process.memory_info().rss)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        result = call()
+    finally:
+        done.set()
+        sampler.join()
+    return result, max(peak, process.memory_info().rss)
+
+
+def benchmark_point(function, n, y_width=None, seed=0, backend=None, shots=1, **mode):
+    # Builds, transpiles and runs one circuit; returns a result row (see run_benchmarks)
+    row, peak_rss = _peak_rss_during(lambda: _benchmark_point(function, n, y_width, seed, backend, shots, mode))
+    row["peak_rss_bytes"] = peak_rss
+    return row
+
+
+def _benchmark_point(function, n, y_width, seed, backend, shots, mode):
+    start = time.perf_counter()
+    if function == "multiply_mod_fixed_power_Y":
+        circuit = _power_Y(n, y_width, seed, mode)
+    else:
+        circuit = _arithmetic(function, n, y_width, seed, mode.get("gate_library", "standard"))
+    build_s = time.perf_counter() - start
+
+    point_backend = backend if backend is not None else select_backend(circuit, report=False)
+
+    start = time.perf_counter()
+    transpiled_circuit = transpile_for(circuit, point_backend)
+    transpile_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    counts = point_backend.run(transpiled_circuit, shots=shots).result().get_counts(0)
+    run_s = time.perf_counter() - start
+
+    return {
+        "function": function,
+        "n": n,
+        "y_width": y_width,
+        "backend": point_backend.name,
+        "build_s": build_s,
+        "transpile_s": transpile_s,
+        "run_s": run_s,
+        "qubits": circuit.num_qubits,
+        "gates": circuit.size(),
+        "depth": circuit.depth(),
+        "counts": counts,
+    }
+
+
+def run_benchmarks(widths, y_widths=(1,), functions=None, seed=0, backend=None, repeat=1, **mode):
+    # Every function of functions (FUNCTIONS by default) for every n in widths, and every exponent width
+    # in y_widths for the functions in EXPONENT_FUNCTIONS; backend=None picks one per circuit with select_backend.
+    # The times are the best of repeat runs. mode goes to build_power_Y_core (adder, reduction, optimize, ...)
+    # returns {"environment": {...}, "results": [row, ...]}
+    if functions is None:
+        functions = FUNCTIONS
+
+    results = []
+    for function in functions:
+        for n in widths:
+            for y_width in (y_widths if function in EXPONENT_FUNCTIONS else [None]):
+                rows = [benchmark_point(function, n, y_width=y_width, seed=seed, backend=backend, **mode) for _ in range(repeat)]
+                row = rows[-1]
+                for metric in TIME_METRICS:
+                    row[metric] = min(r[metric] for r in rows)
+                results.append(row)
+
+    environment = {
+        "python": platform.python_version(),
+        "qiskit": qiskit.__version__,
+        "platform": platform.platform(),
+        "cpus": psutil.cpu_count(),
+        "gate_library": mode.get("gate_library", "standard"),
+        "mode": mode,
+        "seed": seed,
+    }
+    return {"environment": environment, "results": results}
+
+
+def _key(row):
+    return row["function"], row["n"], row["y_width"]
+
+
+def compare_to_baseline(report, baseline, tolerance=0.25, min_seconds=0.01):
+    # Regressions of report against baseline (both as returned by run_benchmarks):
+    # a time more than tolerance (relative) and min_seconds above the baseline, or any size above it.
+    # returns [(function, n, y_width, metric, baseline value, new value), ...]
+    baseline_rows = {_key(row): row for row in baseline["results"]}
+
+    regressions = []
+    for row in report["results"]:
+        old = baseline_rows.get(_key(row))
+        if old is None:
+            continue
+        for metric in TIME_METRICS:
+            if row[metric] > old[metric] * (1 + tolerance) and row[metric] - old[metric] > min_seconds:
+                regressions.append(_key(row) + (metric, old[metric], row[metric]))
+        for metric in SIZE_METRICS:
+            if row[metric] > old[metric]:
+                regressions.append(_key(row) + (metric, old[metric], row[metric]))
+
+    return regressions
+
+
+def format_results(report):
+    lines = [f"{'function':30} {'n':>3} {'y':>3} {'build s':>9} {'transp. s':>9} {'run s':>9} {'qubits':>7} {'gates':>9} {'depth':>9}  backend"]
+    for row in report["results"]:
+        y_width = "" if row["y_width"] is None else row["y_width"]
+        lines.append(f"{row['function']:30} {row['n']:>3} {y_width:>3} {row['build_s']:>9.4f} {row['transpile_s']:>9.4f} {row['run_s']:>9.4f} "
+                     f"{row['qubits']:>7} {row['gates']:>9} {row['depth']:>9}  {row['backend']}")
+    return "\n".join(lines)
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Benchmark the arithmetic of functions.py")
+    parser.add_argument("--widths", type=int, nargs="+", default=[1, 2, 3])
+    parser.add_argument("--y-widths", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--functions", nargs="+", default=None, choices=FUNCTIONS)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--adder", default="ripple")
+    parser.add_argument("--reduction", default="doubling")
+    parser.add_argument("--optimize", action="store_true")
+    parser.add_argument("--gate-library", default="standard", choices=GATE_LIBRARIES)
+    parser.add_argument("--output", help="JSON file for the results")
+    parser.add_argument("--baseline", help="JSON file from an earlier --output to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="relative slowdown reported as a regression")
+    parser.add_argument("--profile", help="collapsed stack file for the calls of the builds (the times are then slower)")
+    parser.add_argument("--profile-metric", default="gates", help="gates, time, calls or a gate name like ccx")
+    options = parser.parse_args(arguments)
+
+    profiler = Profiler() if options.profile else None
+    if profiler:
+        profiler.start()
+    try:
+        report = run_benchmarks(options.widths, y_widths=options.y_widths, functions=options.functions, seed=options.seed, repeat=options.repeat,
+                                adder=options.adder, reduction=options.reduction, optimize=options.optimize, gate_library=options.gate_library)
+    finally:
+        if profiler:
+            profiler.stop()
+    print(format_results(report))
+
+    if profiler:
+        print(format_profile(profiler, max_depth=3))
+        profiler.write_collapsed(options.profile, metric=options.profile_metric)
+
+    if options.output:
+        with open(options.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if options.baseline:
+        with open(options.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare_to_baseline(report, baseline, tolerance=options.tolerance)
+        for function, n, y_width, metric, old, new in regressions:
+            print(f"REGRESSION {function} n={n} y={y_width} {metric}: {old:.4g} -> {new:.4g}")
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
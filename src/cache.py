@@ -0,0 +1,170 @@
+import hashlib
+import os
+from collections import OrderedDict
+import qiskit
+from qiskit import QuantumCircuit, transpile, qpy
+from utilities import *
+from functions import *
+from basis_state import BasisStateSimulator
+from peephole import optimize_circuit
+
+
+def _builder_version():
+    # hash of the source of the modules that build the circuits and of the qiskit version (which transpiles them):
+    # a QPY file written by another version of either is not read back
+    import functions, gates, utilities, registers, peephole
+    digest = hashlib.sha256(qiskit.__version__.encode())
+    for module in (functions, gates, utilities, registers, peephole):
+        with open(module.__file__, "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+BUILDER_VERSION = _builder_version()
+
+
+class CircuitCache:
+    # LRU cache for built and transpiled circuits, keyed by tuples like the ones from power_Y_key
+    # If directory is given every entry is also stored there as a QPY file, so it survives the process;
+    # only the in-memory entries are evicted. The files are keyed by BUILDER_VERSION too, so an edit of the
+    # builders or a qiskit upgrade does not serve circuits built before it
+
+    def __init__(self, max_entries=32, directory=None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha256(repr((BUILDER_VERSION, key)).encode()).hexdigest()
+        return os.path.join(self.directory, digest + ".qpy")
+
+    def _store(self, key, circuit):
+        self.entries[key] = circuit
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False) # least recently used
+
+    def get(self, key):
+        # returns None on a miss
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        if self.directory is not None and os.path.exists(self._path(key)):
+            with open(self._path(key), "rb") as file:
+                circuit = qpy.load(file)[0]
+            self._store(key, circuit)
+            self.hits += 1
+            return circuit
+
+        self.misses += 1
+        return None
+
+    def put(self, key, circuit):
+        self._store(key, circuit)
+
+        if self.directory is not None:
+            with open(self._path(key), "wb") as file:
+                qpy.dump(circuit, file)
+
+    def get_or_build(self, key, build):
+        circuit = self.get(key)
+        if circuit is None:
+            circuit = build()
+            self.put(key, circuit)
+        return circuit
+
+
+def transpile_for(circuits, backend):
+    # the basis-state simulator runs the circuits as they are built
+    if isinstance(backend, BasisStateSimulator):
+        return circuits
+    return transpile(circuits, backend)
+
+
+def power_Y_key(N, X, Y, reset_free=False, adder="ripple", constant=False, window=1, reduction="doubling", optimize=False, gate_library="standard", backend=None, parameterized=False):
+    # everything the circuit built by build_power_Y_core depends on, plus the target of the transpilation
+    # N, X and Y are keyed by value (and N by width too), so an int and the binary string of the same value share an entry
+    backend_name = None if backend is None else backend.name
+    return ("multiply_mod_fixed_power_Y", to_int(N), to_int(X), to_int(Y), register_width(N), reset_free, adder, constant, window, reduction, optimize, parameterized, gate_library, backend_name)
+
+
+def build_power_Y_core(N, X, Y, reset_free=False, adder="ripple", constant=False, window=1, reduction="doubling", optimize=False, gate_library="standard", parameterized=False):
+    # B <- B * X^Y mod N on B = qubits 0..register_width(N)-1, followed by AUX, and B measured into the classical bits
+    # N, X and Y are ints, binary strings or bit arrays, see registers.py
+    # B is not loaded, so the same circuit works for every B; if parameterized, B is loaded by set_bits_parameterized
+    # if optimize, the circuit goes through peephole.optimize_circuit
+
+    # the ancillas are added after B as they are borrowed, see AncillaAllocator
+    B_register = range(register_width(N))
+
+    circuit = QuantumCircuit(len(B_register), len(B_register))
+    if parameterized:
+        set_bits_parameterized(circuit=circuit, A=B_register, name="b")
+    multiply_mod_fixed_power_Y(circuit=circuit, N=N, X=X, B=B_register, AUX=AncillaAllocator(circuit), Y=Y, reset_free=reset_free, adder=adder, constant=constant, window=window, reduction=reduction, gate_library=gate_library)
+    circuit.measure(B_register, range(len(B_register)))
+
+    if optimize:
+        circuit, _ = optimize_circuit(circuit)
+
+    return circuit
+
+
+def cached_power_Y_circuit(cache, b, N, X, Y, backend=None, reset_free=False, adder="ripple", constant=False, window=1, reduction="doubling", optimize=False, gate_library="standard"):
+    # Circuit for b * X^Y mod N, transpiled for backend if given. The arithmetic is built and transpiled
+    # once per key, only the loading of b is added in front of the cached circuit
+    check_width(b, register_width(N), name="b")
+
+    core = cache.get_or_build(power_Y_key(N, X, Y, reset_free=reset_free, adder=adder, constant=constant, window=window, reduction=reduction, optimize=optimize, gate_library=gate_library),
+                              lambda: build_power_Y_core(N, X, Y, reset_free=reset_free, adder=adder, constant=constant, window=window, reduction=reduction, optimize=optimize, gate_library=gate_library))
+
+    if backend is not None:
+        logical_core = core
+        core = cache.get_or_build(power_Y_key(N, X, Y, reset_free=reset_free, adder=adder, constant=constant, window=window, reduction=reduction, optimize=optimize, gate_library=gate_library, backend=backend),
+                                  lambda: transpile_for(logical_core, backend))
+
+    return load_B(core, b)
+
+
+def load_B(core, b):
+    # core (built by build_power_Y_core, possibly transpiled) with B set to b in front of it
+    # after transpile the B register may sit on different physical qubits
+    B_register = range(core.num_clbits)
+    if core.layout is not None:
+        B_register = core.layout.initial_index_layout()[:core.num_clbits]
+
+    circuit = core.copy_empty_like()
+    load_register(circuit=circuit, A=B_register, value=b)
+    circuit.compose(core, inplace=True)
+
+    return circuit
+
+
+def power_Y_sweep(B_values, N, X, Y, backend, cache=None, shots=1, reset_free=False, adder="ripple", constant=False, window=1, reduction="doubling", optimize=False, gate_library="standard"):
+    # Computes b * X^Y mod N for every b in B_values with one build, one transpile and one backend.run:
+    # B is loaded through parameters that are bound at run time
+    # returns {b: counts}
+    for b in B_values:
+        check_width(b, register_width(N), name="b")
+
+    if cache is None:
+        cache = CircuitCache()
+
+    core = cache.get_or_build(power_Y_key(N, X, Y, reset_free=reset_free, adder=adder, constant=constant, window=window, reduction=reduction, optimize=optimize, gate_library=gate_library, parameterized=True),
+                              lambda: build_power_Y_core(N, X, Y, reset_free=reset_free, adder=adder, constant=constant, window=window, reduction=reduction, optimize=optimize, gate_library=gate_library, parameterized=True))
+    transpiled_circuit = cache.get_or_build(power_Y_key(N, X, Y, reset_free=reset_free, adder=adder, constant=constant, window=window, reduction=reduction, optimize=optimize, gate_library=gate_library, backend=backend, parameterized=True),
+                                            lambda: transpile_for(core, backend))
+
+    parameters = sorted(transpiled_circuit.parameters, key=lambda parameter: parameter.index)
+    values = [parameter_values(to_bits(b, register_width(N))) for b in B_values]
+    parameter_binds = {parameters[i]: [value[i] for value in values] for i in range(len(parameters))}
+
+    result = backend.run(transpiled_circuit, shots=shots, parameter_binds=[parameter_binds]).result()
+
+    return {b: result.get_counts(i) for i, b in enumerate(B_values)}
@@ -1,9 +1,26 @@
+from math import pi
+
 from gates import *
 from utilities import *
+from registers import *
 
-def full_adder(circuit, a, b, r, c_in, c_out, AUX):
+def full_adder(circuit, a, b, r, c_in, c_out, AUX, reset_free=False):
     # Needs len(AUX)=3.
 
+    if reset_free:
+        # c_out and AUX must be 0 at the beginning, AUX is uncomputed instead of reset
+        def compute(block):
+            xor_gate(circuit=block, a=a, b=b, output=AUX[0])
+            and_gate(circuit=block, a=a, b=b, output=AUX[1])
+            and_gate(circuit=block, a=AUX[0], b=c_in, output=AUX[2])
+
+        def copy_out(circuit):
+            xor_gate(circuit=circuit, a=AUX[0], b=c_in, output=r)
+            or_gate(circuit=circuit, a=AUX[1], b=AUX[2], output=c_out)
+
+        compute_uncompute(circuit=circuit, compute=compute, copy_out=copy_out)
+        return
+
     reset_bits(circuit=circuit, bits=AUX)
     circuit.reset(c_out) # !! c_out must be 0 at the beginning
     
@@ -18,25 +35,245 @@ def full_adder(circuit, a, b, r, c_in, c_out, AUX):
     reset_bits(circuit=circuit, bits=AUX)
 
 
-def controlled_full_adder(circuit, control, a, b, r, c_in, c_out, AUX):
+def controlled_full_adder(circuit, control, a, b, r, c_in, c_out, AUX, reset_free=False, gate_library="standard"):
     # Needs len(AUX)=3.
 
+    if reset_free:
+        # c_out and AUX must be 0 at the beginning, AUX is uncomputed instead of reset
+        def compute(block):
+            xor_gate(circuit=block, a=a, b=b, output=AUX[0])
+            and_gate(circuit=block, a=a, b=b, output=AUX[1])
+            and_gate(circuit=block, a=AUX[0], b=c_in, output=AUX[2])
+
+        def copy_out(circuit):
+            controlled_xor_gate(circuit=circuit, c=control, a=AUX[0], b=c_in, output=r, gate_library=gate_library)
+            controlled_or_gate(circuit=circuit, c=control, a=AUX[1], b=AUX[2], output=c_out, gate_library=gate_library)
+
+        compute_uncompute(circuit=circuit, compute=compute, copy_out=copy_out)
+        return
+
     reset_bits(circuit=circuit, bits=AUX)
     circuit.reset(c_out) # !! c_out must be 0 at the beginning
+
+    if gate_library == "low_cost":
+        # the sum and the carry are computed as by full_adder, only their copy into r and c_out is controlled;
+        # a AND b and (a XOR b) AND c_in are never both 1, so their OR is a XOR
+        xor_gate(circuit=circuit, a=a, b=b, output=AUX[0])
+        and_gate(circuit=circuit, a=a, b=b, output=AUX[1])
+        and_gate(circuit=circuit, a=AUX[0], b=c_in, output=AUX[2])
+
+        controlled_xor_gate(circuit=circuit, c=control, a=AUX[0], b=c_in, output=r, gate_library=gate_library)
+        controlled_xor_gate(circuit=circuit, c=control, a=AUX[1], b=AUX[2], output=c_out, gate_library=gate_library)
+
+        reset_bits(circuit=circuit, bits=AUX)
+        return
     
-    controlled_xor_gate(circuit=circuit, c=control, a=a, b=b, output=AUX[0])
-    controlled_xor_gate(circuit=circuit, c=control, a=AUX[0], b=c_in, output=r)
+    controlled_xor_gate(circuit=circuit, c=control, a=a, b=b, output=AUX[0], gate_library=gate_library)
+    controlled_xor_gate(circuit=circuit, c=control, a=AUX[0], b=c_in, output=r, gate_library=gate_library)
 
     controlled_and_gate(circuit=circuit, c=control, a=a, b=b, output=AUX[1])
     controlled_and_gate(circuit=circuit, c=control, a=AUX[0], b=c_in, output=AUX[2])
 
-    controlled_or_gate(circuit=circuit, c=control, a=AUX[1], b=AUX[2], output=c_out)
+    controlled_or_gate(circuit=circuit, c=control, a=AUX[1], b=AUX[2], output=c_out, gate_library=gate_library)
 
     reset_bits(circuit=circuit, bits=AUX)
 
 
-def add(circuit, A, B, R, AUX):
-    # Needs len(AUX)=5
+def carry_chain(circuit, A, B, C):
+    # Needs len(C) = len(A)+1, C[0] is the carry-in and C[1:] must be |0>
+    # -> C[i+1] is the carry out of bit i
+
+    for i in range(len(A)):
+        majority_gate(circuit=circuit, a=A[i], b=B[i], c=C[i], output=C[i+1])
+
+
+def sum_bits(circuit, A, B, C, R):
+    for i in range(len(A)):
+        xor_gate(circuit=circuit, a=A[i], b=B[i], output=R[i])
+        circuit.cx(C[i], R[i])
+
+
+def controlled_sum_bits(circuit, control, A, B, C, R, gate_library="standard"):
+    # R gets the sum bits if control is 1, A otherwise
+
+    for i in range(len(A)):
+        circuit.cx(A[i], R[i])
+        controlled_xor_gate(circuit=circuit, c=control, a=B[i], b=C[i], output=R[i], gate_library=gate_library)
+
+
+def phase_add(circuit, A, B, sign=1, controls=()):
+    # Draper adder: B must be in Fourier space (see qft), B <- B + sign*A mod 2^len(B)
+    # A can be shorter than B. No ancillas are needed, the sum is made of controlled phases
+
+    for j in range(len(B)):
+        for i in range(min(j+1, len(A))):
+            angle = sign * pi / 2**(j-i)
+            if controls:
+                circuit.mcp(angle, list(controls) + [A[i]], B[j])
+            else:
+                circuit.cp(angle, A[i], B[j])
+
+
+def phase_add_constant(circuit, a, B, controls=()):
+    # B must be in Fourier space, B <- B + a mod 2^len(B) for a classical (possibly negative) a
+    # Only one phase rotation per qubit, no ancillas
+
+    for j in range(len(B)):
+        angle = 2 * pi * (a % 2**(j+1)) / 2**(j+1)
+        if angle == 0:
+            continue
+
+        if controls:
+            circuit.mcp(angle, list(controls), B[j])
+        else:
+            circuit.p(angle, B[j])
+
+
+def phase_add_mod_constant(circuit, N, a, B, AUX, controls=()):
+    # Beauregard modular adder: B <- B + a mod N if all the controls are 1, for classical N and a < N
+    # B must be in Fourier space, have len(B) = bit length of N + 1 and hold a value < N
+    # Needs len(AUX)=1, AUX[0] must be |0> and is returned to |0>
+
+    msb = B[len(B)-1]
+
+    phase_add_constant(circuit=circuit, a=a, B=B, controls=controls)
+    phase_add_constant(circuit=circuit, a=-N, B=B)
+
+    inverse_qft(circuit, B)
+    circuit.cx(msb, AUX[0]) # AUX[0] = 1 if B + a - N went negative
+    qft(circuit, B)
+
+    phase_add_constant(circuit=circuit, a=N, B=B, controls=[AUX[0]])
+
+    # uncompute AUX[0]: B + a mod N - a is negative exactly when N was not added back
+    phase_add_constant(circuit=circuit, a=-a, B=B, controls=controls)
+    inverse_qft(circuit, B)
+    circuit.x(msb)
+    circuit.cx(msb, AUX[0])
+    circuit.x(msb)
+    qft(circuit, B)
+    phase_add_constant(circuit=circuit, a=a, B=B, controls=controls)
+
+
+def add_in_place(circuit, A, B, AUX, c_out=None, adder="cuccaro"):
+    # Cuccaro ripple-carry adder: B <- A + B mod 2^len(A), A is left unchanged
+    # Needs len(AUX)=1, AUX[0] must be |0> and is returned to |0>
+    # The carries ripple through A itself; if c_out is given, the carry out is XORed into it
+    # With adder "draper" the sum is done in Fourier space instead and needs no ancillas
+
+    if adder == "draper":
+        if c_out is not None:
+            raise ValueError("the draper adder has no carry out")
+
+        qft(circuit, B)
+        phase_add(circuit=circuit, A=A, B=B)
+        inverse_qft(circuit, B)
+        return
+
+    carries = [AUX[0]] + list(A[:-1])
+
+    for i in range(len(A)):
+        maj_gate(circuit=circuit, c_in=carries[i], b=B[i], a=A[i])
+
+    if c_out is not None:
+        circuit.cx(A[len(A)-1], c_out)
+
+    for i in reversed(range(len(A))):
+        uma_gate(circuit=circuit, c_in=carries[i], b=B[i], a=A[i])
+
+
+def controlled_add_in_place(circuit, control, A, B, AUX, adder="cuccaro", gate_library="standard"):
+    # B <- A + B mod 2^len(A) if control is 1, B is left unchanged otherwise
+    # Needs len(AUX)=1 (0 if adder is "draper"), AUX[0] must be |0> and is returned to |0>
+
+    if adder == "draper":
+        qft(circuit, B)
+        phase_add(circuit=circuit, A=A, B=B, controls=[control])
+        inverse_qft(circuit, B)
+        return
+
+    carries = [AUX[0]] + list(A[:-1])
+
+    for i in range(len(A)):
+        maj_gate(circuit=circuit, c_in=carries[i], b=B[i], a=A[i])
+
+    for i in reversed(range(len(A))):
+        controlled_uma_gate(circuit=circuit, c=control, c_in=carries[i], b=B[i], a=A[i], gate_library=gate_library)
+
+
+def subtract_in_place(circuit, A, B, AUX, adder="cuccaro"):
+    # B <- B - A mod 2^len(A), computed as not(not(B) + A)
+    # Needs len(AUX)=1 (0 if adder is "draper"), AUX[0] must be |0> and is returned to |0>
+
+    if adder == "draper":
+        qft(circuit, B)
+        phase_add(circuit=circuit, A=A, B=B, sign=-1)
+        inverse_qft(circuit, B)
+        return
+
+    for i in range(len(B)):
+        circuit.x(B[i])
+
+    add_in_place(circuit=circuit, A=A, B=B, AUX=AUX, adder=adder)
+
+    for i in range(len(B)):
+        circuit.x(B[i])
+
+
+def controlled_subtract_in_place(circuit, control, A, B, AUX, adder="cuccaro", gate_library="standard"):
+    # B <- B - A mod 2^len(A) if control is 1, B is left unchanged otherwise
+    # Needs len(AUX)=1 (0 if adder is "draper"), AUX[0] must be |0> and is returned to |0>
+
+    if adder == "draper":
+        qft(circuit, B)
+        phase_add(circuit=circuit, A=A, B=B, sign=-1, controls=[control])
+        inverse_qft(circuit, B)
+        return
+
+    for i in range(len(B)):
+        circuit.x(B[i])
+
+    controlled_add_in_place(circuit=circuit, control=control, A=A, B=B, AUX=AUX, adder=adder, gate_library=gate_library)
+
+    for i in range(len(B)):
+        circuit.x(B[i])
+
+
+def adder_aux_size(n, reset_free=False, adder="ripple"):
+    # len(AUX) needed by add, subtract, controlled_add and controlled_subtract for len(A) = n
+    if adder == "cuccaro":
+        return 1
+    if adder == "draper":
+        return 0
+    return n + 1 if reset_free else 5
+
+
+def add(circuit, A, B, R, AUX, reset_free=False, adder="ripple"):
+    # Needs len(AUX)=5 (len(A)+1 if reset_free, 1 if adder is "cuccaro", 0 if adder is "draper")
+    # AUX can also be an AncillaAllocator, the same holds for all the functions below
+
+    if isinstance(AUX, AncillaAllocator):
+        with_ancillas(circuit, AUX, adder_aux_size(len(A), reset_free, adder), reset=not reset_free,
+                      call=lambda AUX: add(circuit=circuit, A=A, B=B, R=R, AUX=AUX, reset_free=reset_free, adder=adder))
+        return
+
+    if adder in ("cuccaro", "draper"):
+        # R must be |0>: R <- A, then R <- R + B in place
+        if not reset_free:
+            reset_bits(circuit=circuit, bits=AUX[:1])
+
+        for i in range(len(A)):
+            circuit.cx(A[i], R[i])
+        add_in_place(circuit=circuit, A=B, B=R, AUX=AUX, adder=adder)
+        return
+
+    if reset_free:
+        carries = AUX[:len(A)+1]
+
+        compute_uncompute(circuit=circuit,
+                          compute=lambda block: carry_chain(circuit=block, A=A, B=B, C=carries),
+                          copy_out=lambda circuit: sum_bits(circuit=circuit, A=A, B=B, C=carries, R=R))
+        return
 
     reset_bits(circuit=circuit, bits=AUX)
 
@@ -52,8 +289,31 @@ def add(circuit, A, B, R, AUX):
     reset_bits(circuit=circuit, bits=AUX)
 
 
-def controlled_add(circuit, control, A, B, R, AUX):
-    # Needs len(AUX)=5
+def controlled_add(circuit, control, A, B, R, AUX, reset_free=False, adder="ripple", gate_library="standard"):
+    # Needs len(AUX)=5 (len(A)+1 if reset_free, 1 if adder is "cuccaro", 0 if adder is "draper")
+
+    if isinstance(AUX, AncillaAllocator):
+        with_ancillas(circuit, AUX, adder_aux_size(len(A), reset_free, adder), reset=not reset_free,
+                      call=lambda AUX: controlled_add(circuit=circuit, control=control, A=A, B=B, R=R, AUX=AUX, reset_free=reset_free, adder=adder, gate_library=gate_library))
+        return
+
+    if adder in ("cuccaro", "draper"):
+        # R must be |0>: R <- A, then R <- R + B in place if control is 1
+        if not reset_free:
+            reset_bits(circuit=circuit, bits=AUX[:1])
+
+        for i in range(len(A)):
+            circuit.cx(A[i], R[i])
+        controlled_add_in_place(circuit=circuit, control=control, A=B, B=R, AUX=AUX, adder=adder, gate_library=gate_library)
+        return
+
+    if reset_free:
+        carries = AUX[:len(A)+1]
+
+        compute_uncompute(circuit=circuit,
+                          compute=lambda block: carry_chain(circuit=block, A=A, B=B, C=carries),
+                          copy_out=lambda circuit: controlled_sum_bits(circuit=circuit, control=control, A=A, B=B, C=carries, R=R, gate_library=gate_library))
+        return
 
     reset_bits(circuit=circuit, bits=AUX)
 
@@ -65,7 +325,7 @@ def controlled_add(circuit, control, A, B, R, AUX):
                    r=R[i], 
                    c_in=AUX[i % 2], 
                    c_out=AUX[(i+1) % 2], 
-                   AUX=AUX[2:])
+                   AUX=AUX[2:], gate_library=gate_library)
         
      # we have to copy A to R if control is 0
     circuit.x(control)
@@ -75,8 +335,41 @@ def controlled_add(circuit, control, A, B, R, AUX):
     reset_bits(circuit=circuit, bits=AUX)
 
 
-def subtract(circuit, A, B, R, AUX):
-    # Needs len(AUX)=5
+def negated_carry_chain(circuit, A, B, C):
+    # A - B = A + not(B) + 1: leaves B negated, C[0] set and the carries of the sum in C[1:]
+
+    for i in range(len(B)):
+        circuit.x(B[i])
+    circuit.x(C[0])
+
+    carry_chain(circuit=circuit, A=A, B=B, C=C)
+
+
+def subtract(circuit, A, B, R, AUX, reset_free=False, adder="ripple"):
+    # Needs len(AUX)=5 (len(A)+1 if reset_free, 1 if adder is "cuccaro", 0 if adder is "draper")
+
+    if isinstance(AUX, AncillaAllocator):
+        with_ancillas(circuit, AUX, adder_aux_size(len(A), reset_free, adder), reset=not reset_free,
+                      call=lambda AUX: subtract(circuit=circuit, A=A, B=B, R=R, AUX=AUX, reset_free=reset_free, adder=adder))
+        return
+
+    if adder in ("cuccaro", "draper"):
+        # R must be |0>: R <- A, then R <- R - B in place
+        if not reset_free:
+            reset_bits(circuit=circuit, bits=AUX[:1])
+
+        for i in range(len(A)):
+            circuit.cx(A[i], R[i])
+        subtract_in_place(circuit=circuit, A=B, B=R, AUX=AUX, adder=adder)
+        return
+
+    if reset_free:
+        carries = AUX[:len(A)+1]
+
+        compute_uncompute(circuit=circuit,
+                          compute=lambda block: negated_carry_chain(circuit=block, A=A, B=B, C=carries),
+                          copy_out=lambda circuit: sum_bits(circuit=circuit, A=A, B=B, C=carries, R=R))
+        return
 
     l = len(A)
 
@@ -99,8 +392,32 @@ def subtract(circuit, A, B, R, AUX):
         circuit.x(B[i])
 
 
-def controlled_subtract(circuit, control, A, B, R, AUX):
-    # Needs len(AUX)=5
+def controlled_subtract(circuit, control, A, B, R, AUX, reset_free=False, adder="ripple", gate_library="standard"):
+    # Needs len(AUX)=5 (len(A)+1 if reset_free, 1 if adder is "cuccaro", 0 if adder is "draper")
+
+    if isinstance(AUX, AncillaAllocator):
+        with_ancillas(circuit, AUX, adder_aux_size(len(A), reset_free, adder), reset=not reset_free,
+                      call=lambda AUX: controlled_subtract(circuit=circuit, control=control, A=A, B=B, R=R, AUX=AUX, reset_free=reset_free, adder=adder, gate_library=gate_library))
+        return
+
+    if adder in ("cuccaro", "draper"):
+        # R must be |0>: R <- A, then R <- R - B in place if control is 1
+        if not reset_free:
+            reset_bits(circuit=circuit, bits=AUX[:1])
+
+        for i in range(len(A)):
+            circuit.cx(A[i], R[i])
+        controlled_subtract_in_place(circuit=circuit, control=control, A=B, B=R, AUX=AUX, adder=adder, gate_library=gate_library)
+        return
+
+    if reset_free:
+        carries = AUX[:len(A)+1]
+
+        compute_uncompute(circuit=circuit,
+                          compute=lambda block: negated_carry_chain(circuit=block, A=A, B=B, C=carries),
+                          copy_out=lambda circuit: controlled_sum_bits(circuit=circuit, control=control, A=A, B=B, C=carries, R=R, gate_library=gate_library))
+        return
+
     l = len(A)
     
     for i in range(len(B)): # negate all bits of B
@@ -117,7 +434,7 @@ def controlled_subtract(circuit, control, A, B, R, AUX):
                    r=R[i], 
                    c_in=AUX[i % 2], 
                    c_out=AUX[(i+1) % 2], 
-                   AUX=AUX[2:])
+                   AUX=AUX[2:], gate_library=gate_library)
 
     for i in range(len(B)): # bring back the bits of B
         circuit.cx(control, B[i])
@@ -128,14 +445,35 @@ def controlled_subtract(circuit, control, A, B, R, AUX):
     circuit.x(control)
 
 
-def greater_than(circuit, A, B, r, AUX):
+def greater_than(circuit, A, B, r, AUX, reset_free=False, adder="ripple"):
     # IDEA:
     # 1) compute B-A
     # 2) if the carry out of the subtraction is 0, then A>B
     #   -> the negation of the carry out is A > B
     #
     #! -> the subtraction function should NOT reset AUX after the computation
-    # Needs len(AUX) = 5+len(A)
+    # Needs len(AUX) = 5+len(A) (len(A)+1 if reset_free or adder is "draper", 1 if adder is "cuccaro")
+
+    if isinstance(AUX, AncillaAllocator):
+        # the carry chain alone returns its ancillas clean, so it is used in reset mode too
+        with_ancillas(circuit, AUX, 1 if adder == "cuccaro" else len(A)+1, reset=False,
+                      call=lambda AUX: greater_than(circuit=circuit, A=A, B=B, r=r, AUX=AUX, reset_free=True, adder=adder))
+        return
+
+    if adder in ("cuccaro", "draper"):
+        greater_than_or_equal(circuit=circuit, A=B, B=A, r=r, AUX=AUX, reset_free=reset_free, adder=adder)
+        circuit.x(r)
+        return
+
+    if reset_free:
+        # only the carry out of B-A is needed, so the difference itself is never written
+        carries = AUX[:len(A)+1]
+
+        compute_uncompute(circuit=circuit,
+                          compute=lambda block: negated_carry_chain(circuit=block, A=B, B=A, C=carries),
+                          copy_out=lambda circuit: circuit.cx(carries[len(A)], r))
+        circuit.x(r)
+        return
 
     reset_bits(circuit, AUX)
     result_register = AUX[:len(A)]
@@ -149,13 +487,70 @@ def greater_than(circuit, A, B, r, AUX):
     reset_bits(circuit, AUX)
 
 
-def greater_than_or_equal(circuit, A, B, r, AUX):
+def cuccaro_compare_chain(circuit, A, B, C):
+    # carry out of A + not(B) + 1 with the majority half of the Cuccaro adder: leaves it in B[-1]
+    # Needs C to be a single |0> qubit, A and B are restored when this is uncomputed
+
+    for i in range(len(B)):
+        circuit.x(B[i])
+    circuit.x(C)
+
+    carries = [C] + list(B[:-1])
+    for i in range(len(B)):
+        maj_gate(circuit=circuit, c_in=carries[i], b=A[i], a=B[i])
+
+
+def greater_than_or_equal(circuit, A, B, r, AUX, reset_free=False, adder="ripple"):
     # IDEA:
     # 1) Compute A - B
     # 2) If the carry-out of the subtraction is 1, then A >= B
     #
     #! -> The subtraction function should NOT reset AUX after the computation
-    # Needs len(AUX) = 5+len(A)
+    # Needs len(AUX) = 5+len(A) (len(A)+1 if reset_free or adder is "draper", 1 if adder is "cuccaro")
+
+    if isinstance(AUX, AncillaAllocator):
+        # the carry chain alone returns its ancillas clean, so it is used in reset mode too
+        with_ancillas(circuit, AUX, 1 if adder == "cuccaro" else len(A)+1, reset=False,
+                      call=lambda AUX: greater_than_or_equal(circuit=circuit, A=A, B=B, r=r, AUX=AUX, reset_free=True, adder=adder))
+        return
+
+    if adder == "cuccaro":
+        if not reset_free:
+            reset_bits(circuit=circuit, bits=AUX[:1])
+
+        compute_uncompute(circuit=circuit,
+                          compute=lambda block: cuccaro_compare_chain(circuit=block, A=A, B=B, C=AUX[0]),
+                          copy_out=lambda circuit: circuit.cx(B[len(B)-1], r))
+        return
+
+    if adder == "draper":
+        # the sign bit of A - B on len(A)+1 bits is 1 exactly when A < B
+        difference = AUX[:len(A)+1]
+        if not reset_free:
+            reset_bits(circuit=circuit, bits=difference)
+
+        def compute(block):
+            for i in range(len(A)):
+                block.cx(A[i], difference[i])
+            qft(block, difference)
+            phase_add(circuit=block, A=B, B=difference, sign=-1)
+            inverse_qft(block, difference)
+
+        def copy_out(circuit):
+            circuit.cx(difference[len(A)], r)
+            circuit.x(r)
+
+        compute_uncompute(circuit=circuit, compute=compute, copy_out=copy_out)
+        return
+
+    if reset_free:
+        # only the carry out of A-B is needed, so the difference itself is never written
+        carries = AUX[:len(A)+1]
+
+        compute_uncompute(circuit=circuit,
+                          compute=lambda block: negated_carry_chain(circuit=block, A=A, B=B, C=carries),
+                          copy_out=lambda circuit: circuit.cx(carries[len(A)], r))
+        return
 
     reset_bits(circuit, AUX)
     result_register = AUX[:len(A)]
@@ -169,100 +564,379 @@ def greater_than_or_equal(circuit, A, B, r, AUX):
     reset_bits(circuit, AUX)
 
 
-def add_mod(circuit, N, A, B, R, AUX):
-    # Needs len(AUX) = 2*len(A)+6
+def add_mod_in_place(circuit, N, A, B, AUX, adder="cuccaro", gate_library="standard"):
+    # B <- A + B, minus N if the sum is >= N (same result as add_mod)
+    # Needs len(AUX) = 2 (len(A)+2 if adder is "draper")
+    # The comparison bit cannot be uncomputed from the result, so it is reset
 
     reset_bits(circuit=circuit, bits=AUX)
 
-    result_add = AUX[:len(A)]
-    result_gt = AUX[len(A):len(A)+1]
-    add_sub_aux = AUX[len(A)+1:len(A)+1+5]
-    gt_aux = AUX[len(A)+1:len(A)+1+5+len(A)]
+    add_in_place(circuit=circuit, A=A, B=B, AUX=AUX[1:], adder=adder)
+    greater_than_or_equal(circuit=circuit, A=B, B=N, r=AUX[0], AUX=AUX[1:], adder=adder)
+    controlled_subtract_in_place(circuit=circuit, control=AUX[0], A=N, B=B, AUX=AUX[1:], adder=adder, gate_library=gate_library)
+
+    reset_bits(circuit=circuit, bits=AUX)
+
+
+def add_mod(circuit, N, A, B, R, AUX, reset_free=False, adder="ripple", gate_library="standard"):
+    # Needs len(AUX) = 2*len(A)+6
+    # with adder "cuccaro": len(AUX) = 2 (len(A)+5 if reset_free)
+    # with adder "draper": len(AUX) = len(A)+2 (2*len(A)+6 if reset_free)
+    # In reset mode A + B wraps at 2^len(A) before N is subtracted; if reset_free it does not,
+    # so R = A + B mod N exactly for A, B < N
+
+    if isinstance(AUX, AncillaAllocator) and (reset_free or adder != "ripple"):
+        raise ValueError("add_mod only borrows from an AncillaAllocator with the ripple adder in reset mode")
+
+    if adder in ("cuccaro", "draper") and not reset_free:
+        # R must be |0>
+        for i in range(len(B)):
+            circuit.cx(B[i], R[i])
+        add_mod_in_place(circuit=circuit, N=N, A=A, B=R, AUX=AUX, adder=adder, gate_library=gate_library)
+        return
+
+    if reset_free:
+        # the sum gets len(A)+1 bits, A, B and N are padded with |0> qubits to that width
+        l = len(A)
+        result_add = AUX[:l+1]
+        result_gt = AUX[l+1]
+        zeros = AUX[l+2:l+4] # only used as operands, they are |0> again afterwards
+        add_sub_aux = AUX[l+4:]
+
+        def compute(block):
+            add(circuit=block, A=list(A) + [zeros[0]], B=list(B) + [zeros[1]], R=result_add, AUX=add_sub_aux, reset_free=True, adder=adder)
+            greater_than_or_equal(circuit=block, A=result_add, B=list(N) + [zeros[0]], r=result_gt, AUX=add_sub_aux, reset_free=True, adder=adder)
+
+        def copy_out(circuit):
+            # the result is below N, so the low len(A) bits of the sum are enough
+            controlled_subtract(circuit=circuit, control=result_gt, A=result_add[:l], B=N, R=R, AUX=add_sub_aux, reset_free=True, adder=adder, gate_library=gate_library)
+
+        compute_uncompute(circuit=circuit, compute=compute, copy_out=copy_out)
+        return
+
+    (result_add, result_gt), rest = take_registers(circuit, AUX, len(A), 1)
+    if isinstance(rest, AncillaAllocator):
+        add_sub_aux, gt_aux = rest, rest
+    else:
+        add_sub_aux, gt_aux = rest[:5], rest[:5+len(A)]
 
     add(circuit=circuit, A=A, B=B, R=result_add, AUX=add_sub_aux) # add both numbers
     
-    greater_than_or_equal(circuit=circuit, A=result_add, B=N, r=result_gt, AUX=gt_aux) # test whether the result is greater than N
+    greater_than_or_equal(circuit=circuit, A=result_add, B=N, r=result_gt[0], AUX=gt_aux) # test whether the result is greater than N
     
-    controlled_subtract(circuit=circuit, control=result_gt, A=result_add, B=N, R=R, AUX=add_sub_aux) # if yes, then subtract N from the result
+    controlled_subtract(circuit=circuit, control=result_gt[0], A=result_add, B=N, R=R, AUX=add_sub_aux, gate_library=gate_library) # if yes, then subtract N from the result
     
-    reset_bits(circuit=circuit, bits=AUX)
+    release_registers(circuit=circuit, AUX=AUX, registers=[result_add, result_gt])
 
 
-def times_two_mod(circuit, N, A, R, AUX):
+def times_two_mod(circuit, N, A, R, AUX, reset_free=False, adder="ripple", gate_library="standard"):
     # Needs len(AUX) = 3*len(A)+6
+    # with adder "cuccaro": len(AUX) = 2 (2*len(A)+5 if reset_free)
+    # with adder "draper": len(AUX) = len(A)+2 (3*len(A)+6 if reset_free)
+
+    if isinstance(AUX, AncillaAllocator) and (reset_free or adder != "ripple"):
+        raise ValueError("times_two_mod only borrows from an AncillaAllocator with the ripple adder in reset mode")
+
+    if adder in ("cuccaro", "draper") and not reset_free:
+        # R must be |0>: R <- A, then R <- A + R mod N in place
+        for i in range(len(A)):
+            circuit.cx(A[i], R[i])
+        add_mod_in_place(circuit=circuit, N=N, A=A, B=R, AUX=AUX, adder=adder, gate_library=gate_library)
+        return
+
+    if reset_free:
+        temp_register = AUX[:len(A)]
+        add_mod_aux = AUX[len(A):]
+
+        compute_uncompute(circuit=circuit,
+                          compute=lambda block: copy(block, A, temp_register),
+                          copy_out=lambda circuit: add_mod(circuit=circuit, N=N, A=A, B=temp_register, R=R, AUX=add_mod_aux, reset_free=True, adder=adder, gate_library=gate_library))
+        return
     
-    reset_bits(circuit, AUX)
-
-    temp_register = AUX[:len(A)]
-    add_mod_aux = AUX[len(A):]
+    (temp_register,), add_mod_aux = take_registers(circuit, AUX, len(A))
 
     copy(circuit, A, temp_register) # copy A to the temporary register
 
-    add_mod(circuit=circuit, N=N, A=A, B=temp_register, R=R, AUX=add_mod_aux) # compute A + A mod N
+    add_mod(circuit=circuit, N=N, A=A, B=temp_register, R=R, AUX=add_mod_aux, gate_library=gate_library) # compute A + A mod N
 
-    reset_bits(circuit, AUX)
+    release_registers(circuit=circuit, AUX=AUX, registers=[temp_register])
 
 
-def times_two_power_mod(circuit,N,A,k,R,AUX):
-    # Needs len(AUX) = 4*len(A)+6
+def times_two_power_mod(circuit,N,A,k,R,AUX,reset_free=False,adder="ripple",gate_library="standard"):
+    # Needs len(AUX) = 4*len(A)+6 ((k+2)*len(A)+6 if reset_free, len(A)+2 if k == 0)
+    # with adder "cuccaro": len(AUX) = len(A)+2 ((k+1)*len(A)+5 if reset_free, 2 if k == 0)
+    # with adder "draper": len(AUX) = 2*len(A)+2 ((k+2)*len(A)+6 if reset_free, len(A)+2 if k == 0)
 
-    reset_bits(circuit=circuit, bits=AUX)
+    if isinstance(AUX, AncillaAllocator) and (reset_free or adder != "ripple"):
+        raise ValueError("times_two_power_mod only borrows from an AncillaAllocator with the ripple adder in reset mode")
+
+    if adder in ("cuccaro", "draper") and not reset_free:
+        # R must be |0>: R <- A, then it is doubled in place k times
+        reset_bits(circuit=circuit, bits=AUX)
+
+        temp_register = AUX[:len(A)]
+        add_mod_aux = AUX[len(A):]
+
+        for i in range(len(A)):
+            circuit.cx(A[i], R[i])
 
-    temp_register = AUX[:len(A)]
-    times_two_mod_aux = AUX[len(A):]
+        if k == 0:
+            # the result will be A mod N
+            greater_than_or_equal(circuit=circuit, A=R, B=N, r=add_mod_aux[0], AUX=add_mod_aux[1:], adder=adder)
+            controlled_subtract_in_place(circuit=circuit, control=add_mod_aux[0], A=N, B=R, AUX=add_mod_aux[1:], adder=adder, gate_library=gate_library)
+
+        for i in range(k):
+            copy(circuit=circuit, A=R, B=temp_register)
+            add_mod_in_place(circuit=circuit, N=N, A=temp_register, B=R, AUX=add_mod_aux, adder=adder, gate_library=gate_library)
+            reset_bits(circuit=circuit, bits=temp_register) # the copy() function expects B to be |0>
+
+        reset_bits(circuit=circuit, bits=AUX)
+        return
+
+    if reset_free:
+        if k == 0:
+            # the result will be A mod N
+            def compute(block):
+                greater_than_or_equal(circuit=block, A=A, B=N, r=AUX[0], AUX=AUX[1:], reset_free=True, adder=adder)
+
+            def copy_out(circuit):
+                controlled_subtract(circuit=circuit, control=AUX[0], A=A, B=N, R=R, AUX=AUX[1:], reset_free=True, adder=adder, gate_library=gate_library)
+        else:
+            # every intermediate doubling gets its own register, they are all uncomputed at the end
+            doubled = [A] + [AUX[i*len(A):(i+1)*len(A)] for i in range(k-1)]
+            times_two_mod_aux = AUX[(k-1)*len(A):]
+
+            def compute(block):
+                for i in range(k-1):
+                    times_two_mod(circuit=block, N=N, A=doubled[i], R=doubled[i+1], AUX=times_two_mod_aux, reset_free=True, adder=adder, gate_library=gate_library)
+
+            def copy_out(circuit):
+                times_two_mod(circuit=circuit, N=N, A=doubled[k-1], R=R, AUX=times_two_mod_aux, reset_free=True, adder=adder, gate_library=gate_library)
+
+        compute_uncompute(circuit=circuit, compute=compute, copy_out=copy_out)
+        return
+
+    if k == 0:
+        # the result will be A mod N
+        (flag,), rest = take_registers(circuit, AUX, 1)
+        greater_than_or_equal(circuit=circuit, A=A, B=N, r=flag[0], AUX=rest)
+        controlled_subtract(circuit=circuit, control=flag[0], A=A, B=N, R=R, AUX=rest, gate_library=gate_library)
+        release_registers(circuit=circuit, AUX=AUX, registers=[flag])
+        return
+
+    (temp_register,), times_two_mod_aux = take_registers(circuit, AUX, len(A))
     copy(circuit, A, temp_register)
 
     for i in range(k):
-        times_two_mod(circuit=circuit, N=N, A=temp_register, R=R, AUX=times_two_mod_aux)
+        times_two_mod(circuit=circuit, N=N, A=temp_register, R=R, AUX=times_two_mod_aux, gate_library=gate_library)
         reset_bits(circuit=circuit, bits=temp_register) # the copy() function expects B to be |0>
         copy(circuit=circuit, A=R, B=temp_register)
         reset_bits(circuit=circuit, bits=R) # R should never contain intermediate results
 
-    if k > 0:
-        copy(circuit=circuit, A=temp_register, B=R)
-    else:
-        # if k==0, the result will be A mod N
-        reset_bits(circuit=circuit, bits=AUX)
-        greater_than_or_equal(circuit=circuit, A=A, B=N, r=AUX[0], AUX=AUX[1:])
-        controlled_subtract(circuit=circuit, control=AUX[0], A=A, B=N, R=R, AUX=AUX[1:])
+    copy(circuit=circuit, A=temp_register, B=R)
 
-    reset_bits(circuit=circuit, bits=AUX)
+    release_registers(circuit=circuit, AUX=AUX, registers=[temp_register])
 
 
-def multiply_mod(circuit, N, A, B, R, AUX):
-    # Needs len(AUX) = 6 * len(A) + 6
+def multiply_mod(circuit, N, A, B, R, AUX, reset_free=False, adder="ripple", reduction="doubling", gate_library="standard"):
+    # Needs len(AUX) = 6 * len(A) + 6 ((2*len(B)+3) * len(A) + 6 if reset_free)
+    # with adder "cuccaro": len(AUX) = 2 * len(A) + 2 ((2*len(B)+2) * len(A) + 5 if reset_free)
+    # with adder "draper": len(AUX) = 3 * len(A) + 2 ((2*len(B)+3) * len(A) + 6 if reset_free)
+    # In reset mode the partial sums wrap at 2^len(A) (see reference.py); if reset_free they are added
+    # with add_mod, so R = A * B mod N exactly for A < 2N
+    # reduction "montgomery" computes A * B * 2^-len(B) mod N instead, see multiply_mod_montgomery
 
-    reset_bits(circuit=circuit, bits=AUX)
+    if reduction == "montgomery":
+        if reset_free:
+            raise ValueError("the montgomery reduction is only available in reset mode")
+        multiply_mod_montgomery(circuit=circuit, N=N, A=A, B=B, R=R, AUX=AUX, adder=adder, gate_library=gate_library)
+        return
+
+    if isinstance(AUX, AncillaAllocator) and (reset_free or adder != "ripple"):
+        raise ValueError("multiply_mod only borrows from an AncillaAllocator with the ripple adder in reset mode")
 
-    temp_register = AUX[:len(A)]
-    sum_register = AUX[len(A):2*len(A)]
-    times_two_power_mod_aux = AUX[2*len(A):]
+    if adder in ("cuccaro", "draper") and not reset_free:
+        # the partial sums are accumulated in place into R
+        reset_bits(circuit=circuit, bits=AUX)
+        reset_bits(circuit=circuit, bits=R)
+
+        # A*2^k mod N is carried from one bit to the next and doubled in place, like times_two_power_mod does
+        doubled_register = AUX[:len(A)]
+        temp_register = AUX[len(A):2*len(A)]
+        add_mod_aux = AUX[2*len(A):]
+
+        for i in range(len(A)):
+            circuit.cx(A[i], doubled_register[i])
+
+        for k in range(len(B)):
+            if k == 0:
+                # A*2^0 mod N is A mod N, the doublings still start from A like in times_two_power_mod
+                copy(circuit=circuit, A=doubled_register, B=temp_register)
+                greater_than_or_equal(circuit=circuit, A=temp_register, B=N, r=add_mod_aux[0], AUX=add_mod_aux[1:], adder=adder)
+                controlled_subtract_in_place(circuit=circuit, control=add_mod_aux[0], A=N, B=temp_register, AUX=add_mod_aux[1:], adder=adder, gate_library=gate_library)
+                controlled_add_in_place(circuit=circuit, control=B[k], A=temp_register, B=R, AUX=add_mod_aux[1:], adder=adder, gate_library=gate_library) # sum it if B[0] == 1
+                reset_bits(circuit=circuit, bits=temp_register)
+                reset_bits(circuit=circuit, bits=add_mod_aux)
+                continue
+
+            copy(circuit=circuit, A=doubled_register, B=temp_register)
+            add_mod_in_place(circuit=circuit, N=N, A=temp_register, B=doubled_register, AUX=add_mod_aux, adder=adder, gate_library=gate_library) # A*2^k mod N
+            reset_bits(circuit=circuit, bits=temp_register) # the copy() function expects B to be |0>
+            controlled_add_in_place(circuit=circuit, control=B[k], A=doubled_register, B=R, AUX=add_mod_aux, adder=adder, gate_library=gate_library) # sum it if B[k] == 1
+
+        reset_bits(circuit=circuit, bits=AUX)
+        return
+
+    if reset_free:
+        # A*2^k mod N and the partial sums of every step get their own register,
+        # the doublings are chained from A mod N instead of recomputed for every k.
+        # B[k] * A*2^k mod N is copied into term, added to the previous partial sum and copied away again
+        l = len(A)
+        doubled = [AUX[k*l:(k+1)*l] for k in range(len(B))]
+        partial_sums = [AUX[(len(B)+k)*l:(len(B)+k+1)*l] for k in range(len(B)-1)]
+        term = AUX[(2*len(B)-1)*l:2*len(B)*l]
+        scratch = AUX[2*len(B)*l:]
+
+        def compute(block):
+            times_two_power_mod(circuit=block, N=N, A=A, k=0, R=doubled[0], AUX=scratch, reset_free=True, adder=adder, gate_library=gate_library)
+            for k in range(1, len(B)):
+                times_two_mod(circuit=block, N=N, A=doubled[k-1], R=doubled[k], AUX=scratch, reset_free=True, adder=adder, gate_library=gate_library)
+
+            if len(B) > 1:
+                controlled_copy(block, control=B[0], A=doubled[0], B=partial_sums[0])
+            for k in range(1, len(B)-1):
+                controlled_copy(block, control=B[k], A=doubled[k], B=term)
+                add_mod(circuit=block, N=N, A=partial_sums[k-1], B=term, R=partial_sums[k], AUX=scratch, reset_free=True, adder=adder, gate_library=gate_library)
+                controlled_copy(block, control=B[k], A=doubled[k], B=term)
+            if len(B) > 1:
+                controlled_copy(block, control=B[-1], A=doubled[-1], B=term)
+
+        def copy_out(circuit):
+            if len(B) > 1:
+                add_mod(circuit=circuit, N=N, A=partial_sums[-1], B=term, R=R, AUX=scratch, reset_free=True, adder=adder, gate_library=gate_library)
+            else:
+                controlled_copy(circuit, control=B[0], A=doubled[0], B=R)
+
+        compute_uncompute(circuit=circuit, compute=compute, copy_out=copy_out)
+        return
+
+    # A*2^k mod N is carried from one bit to the next, so each bit costs a single times_two_mod
+    registers, times_two_mod_aux = take_registers(circuit, AUX, len(A), len(A), len(A))
+    doubled_register, sum_register, next_register = registers
 
     for k in range(len(B)):
-        reset_bits(circuit=circuit, bits=temp_register)
         reset_bits(circuit=circuit, bits=R) # controlled_add expects R to be |0>
 
-        times_two_power_mod(circuit=circuit, N=N, A=A, k=k, R=temp_register, AUX=times_two_power_mod_aux) # compute A*2^k mod N
-        controlled_add(circuit=circuit, control=B[k], A=sum_register, B=temp_register, R=R, AUX=times_two_power_mod_aux) # sum the result if B[k] == 1
+        if k == 0:
+            times_two_power_mod(circuit=circuit, N=N, A=A, k=0, R=doubled_register, AUX=times_two_mod_aux, gate_library=gate_library) # A mod N
+        else:
+            reset_bits(circuit=circuit, bits=next_register)
+            times_two_mod(circuit=circuit, N=N, A=A if k == 1 else doubled_register, R=next_register, AUX=times_two_mod_aux, gate_library=gate_library) # compute A*2^k mod N
+            doubled_register, next_register = next_register, doubled_register
+
+        controlled_add(circuit=circuit, control=B[k], A=sum_register, B=doubled_register, R=R, AUX=times_two_mod_aux, gate_library=gate_library) # sum the result if B[k] == 1
         reset_bits(circuit=circuit, bits=sum_register) # sum_register should be |0> before copying into it
-        controlled_copy(circuit, control=B[k], A=R, B=sum_register) # copy sum for next iteration
+        copy(circuit=circuit, A=R, B=sum_register) # copy sum for next iteration
         
-    reset_bits(circuit=circuit, bits=AUX)
+    release_registers(circuit=circuit, AUX=AUX, registers=registers)
 
 
-def multiply_mod_fixed(circuit, N, X, B, AUX):
-    # Needs len(AUX) = 8 len (X) + 6
-    
-    reset_bits(circuit=circuit, bits=AUX)
+def multiply_mod_montgomery(circuit, N, A, B, R, AUX, adder="ripple", gate_library="standard"):
+    # R <- A * B * 2^-len(B) mod N, for N odd and A < N
+    # Every bit of B adds B[k]*A to an accumulator T of len(A)+2 bits, then N if T is odd, so that T can be
+    # halved exactly by relabelling its qubits. T stays below 2N, so a single comparison at the end reduces it,
+    # instead of the comparison in every times_two_mod of multiply_mod.
+    # Needs len(AUX) = 3 * len(A) + 15
+    # with adder "cuccaro": len(AUX) = len(A) + 7
+    # with adder "draper": len(AUX) = 2 * len(A) + 9
+
+    l = len(A)
+    w = 2*(l+2) if adder == "ripple" else l+2 # the ripple adder is not in place, it needs a second accumulator
+
+    if isinstance(AUX, AncillaAllocator) and adder != "ripple":
+        raise ValueError("multiply_mod_montgomery only borrows from an AncillaAllocator with the ripple adder")
+    (registers,), adder_aux = take_registers(circuit, AUX, w + 4)
+    registers = list(registers)
+
+    T = registers[:l+2] # the accumulator
+    S = registers[l+2:w] # T + B[k]*A with the ripple adder
+    zeros = registers[w:w+2] # never written, they pad A and N to the width of T
+    parity = registers[w+2]
+    flag = registers[w+3]
+
+    A_padded = list(A) + zeros
+    N_padded = list(N) + zeros
+
+    for k in range(len(B)):
+        if adder == "ripple":
+            reset_bits(circuit=circuit, bits=S) # controlled_add expects R to be |0>
+            controlled_add(circuit=circuit, control=B[k], A=T, B=A_padded, R=S, AUX=adder_aux, gate_library=gate_library) # T + A if B[k] == 1
+            circuit.cx(S[0], parity)
+            reset_bits(circuit=circuit, bits=T)
+            controlled_add(circuit=circuit, control=parity, A=S, B=N_padded, R=T, AUX=adder_aux, gate_library=gate_library) # make it even
+        else:
+            controlled_add_in_place(circuit=circuit, control=B[k], A=A_padded, B=T, AUX=adder_aux, adder=adder, gate_library=gate_library) # T + A if B[k] == 1
+            circuit.cx(T[0], parity)
+            controlled_add_in_place(circuit=circuit, control=parity, A=N_padded, B=T, AUX=adder_aux, adder=adder, gate_library=gate_library) # make it even
+
+        reset_bits(circuit=circuit, bits=[parity])
+        T = T[1:] + T[:1] # T / 2, the bit that was T[0] is |0> and becomes the most significant one
+
+    greater_than_or_equal(circuit=circuit, A=T, B=N_padded, r=flag, AUX=adder_aux, adder=adder) # T < 2N, one subtraction is enough
+    reset_bits(circuit=circuit, bits=R)
+    if adder == "ripple":
+        controlled_subtract(circuit=circuit, control=flag, A=T[:l], B=N, R=R, AUX=adder_aux, gate_library=gate_library)
+    else:
+        controlled_subtract_in_place(circuit=circuit, control=flag, A=N_padded, B=T, AUX=adder_aux, adder=adder, gate_library=gate_library)
+        copy(circuit=circuit, A=T[:l], B=R)
+
+    release_registers(circuit=circuit, AUX=AUX, registers=[registers])
+
+
+def multiply_mod_fixed(circuit, N, X, B, AUX, reset_free=False, X_inverse=None, adder="ripple", reduction="doubling", gate_library="standard"):
+    # Needs len(AUX) = 8 len (X) + 6 (2 len(X)^2 + 5 len(X) + 6 if reset_free)
+    # with adder "cuccaro": len(AUX) = 4 len(X) + 2 (2 len(X)^2 + 4 len(X) + 5 if reset_free)
+    # with adder "draper": len(AUX) = 5 len(X) + 2 (2 len(X)^2 + 5 len(X) + 6 if reset_free)
+    # with reduction "montgomery": len(AUX) = 5 len(X) + 15, 3 len(X) + 7 with adder "cuccaro", 4 len(X) + 9 with adder "draper",
+    # and B <- B * X * 2^-len(B) mod N
+    # X (and X_inverse) is classical, of len(B) bits, see registers.py
+
+    if isinstance(AUX, AncillaAllocator) and (reset_free or adder != "ripple"):
+        raise ValueError("multiply_mod_fixed only borrows from an AncillaAllocator with the ripple adder in reset mode")
+
+    if reset_free:
+        # B*X is swapped into B, then B*X^-1 = old B is taken out of the third register to clear it.
+        # This needs X_inverse = X^-1 mod N, and the third register only returns to |0> if B held a value < N
+        # (B*X mod N itself is exact for any B, see multiply_mod).
+        if X_inverse is None:
+            raise ValueError("multiply_mod_fixed needs X_inverse when reset_free is set")
+
+        first_register = AUX[:len(B)]
+        third_register = AUX[len(B):2*len(B)]
+        fourth_register = AUX[2*len(B):]
+
+        load_register(circuit=circuit, A=first_register, value=X) # -> |X>
+        multiply_mod(circuit=circuit, N=N, A=first_register, B=B, R=third_register, AUX=fourth_register, reset_free=True, adder=adder, reduction=reduction, gate_library=gate_library)
+        load_register(circuit=circuit, A=first_register, value=X) # -> |0>
+
+        for i in range(len(B)):
+            circuit.swap(B[i], third_register[i])
+
+        # the inverse of the multiplication that would write B*X^-1 into a clear third register takes it out again;
+        # XORing a second product into it would not do with the cuccaro and draper adders, which need R = |0>
+        load_register(circuit=circuit, A=first_register, value=X_inverse) # -> |X^-1>
+        block = circuit.copy_empty_like()
+        multiply_mod(circuit=block, N=N, A=first_register, B=B, R=third_register, AUX=fourth_register, reset_free=True, adder=adder, reduction=reduction, gate_library=gate_library)
+        circuit.compose(block.inverse(), inplace=True)
+        load_register(circuit=circuit, A=first_register, value=X_inverse) # -> |0>
+        return
     
-    first_register = AUX[:len(X)]
+    (first_register, third_register), fourth_register = take_registers(circuit, AUX, len(B), len(B))
     second_register = B
-    third_register = AUX[len(X):2*len(X)]
-    fourth_register = AUX[2*len(X):(2*len(X)) + (6*len(X)+6)]
 
-    set_bits(circuit=circuit, A=first_register, X="".join(reversed(X))) # -> |X>
+    load_register(circuit=circuit, A=first_register, value=X) # -> |X>
 
-    multiply_mod(circuit=circuit, N=N, A=first_register, B=second_register, R=third_register, AUX=fourth_register)
+    multiply_mod(circuit=circuit, N=N, A=first_register, B=second_register, R=third_register, AUX=fourth_register, adder=adder, reduction=reduction, gate_library=gate_library)
 
     reset_bits(circuit=circuit, bits=second_register)
     copy(circuit=circuit, A=third_register, B=second_register) # swap second and third register
@@ -279,32 +953,206 @@ def multiply_mod_fixed(circuit, N, X, B, AUX):
 
     # set_bits(circuit=circuit, A=first_register, X="".join(reversed(invert_string(X)))) # -> |0>
 
-    reset_bits(circuit=circuit, bits=AUX)
+    release_registers(circuit=circuit, AUX=AUX, registers=[first_register, third_register])
+
+
+def add_mod_constant(circuit, N, a, B, AUX, controls=(), gate_library="standard"):
+    # Same as phase_add_mod_constant, but with the Cuccaro adder on a register loaded with the constants:
+    # B <- B + a mod N if all the controls are 1, for classical N and a < N
+    # B needs len(B) = bit length of N + 1 and must hold a value < N
+    # Needs len(AUX) = len(B)+2, all |0> and returned to |0>
+
+    constant_register = AUX[:len(B)]
+    flag = AUX[len(B)]
+    adder_aux = AUX[len(B)+1:len(B)+2]
+    msb = B[len(B)-1]
+
+    def load(value, controls=()):
+        load_register(circuit=circuit, A=constant_register, value=value, controls=controls)
+
+    load(a, controls)
+    add_in_place(circuit=circuit, A=constant_register, B=B, AUX=adder_aux)
+    load(a, controls)
+
+    load(N)
+    subtract_in_place(circuit=circuit, A=constant_register, B=B, AUX=adder_aux)
+    circuit.cx(msb, flag) # flag = 1 if B + a - N went negative
+    controlled_add_in_place(circuit=circuit, control=flag, A=constant_register, B=B, AUX=adder_aux, gate_library=gate_library)
+    load(N)
+
+    # uncompute flag: B + a mod N - a is negative exactly when N was not added back
+    load(a, controls)
+    subtract_in_place(circuit=circuit, A=constant_register, B=B, AUX=adder_aux)
+    load(a, controls)
+    circuit.x(msb)
+    circuit.cx(msb, flag)
+    circuit.x(msb)
+    load(a, controls)
+    add_in_place(circuit=circuit, A=constant_register, B=B, AUX=adder_aux)
+    load(a, controls)
+
+
+def multiply_mod_constant(circuit, N, X, B, R, AUX, adder="draper", controls=(), gate_library="standard"):
+    # R <- R + B*X mod N for classical N and X: every X*2^k mod N is computed classically,
+    # so each bit of B only controls one modular addition of a constant and nothing is doubled in qubits
+    # nothing is added unless all the controls are 1
+    # R needs len(B)+1 qubits and must hold a value < N
+    # Needs len(AUX) = 1 (len(B)+3 if adder is "cuccaro"), all |0> and returned to |0>
+
+    if adder == "draper":
+        qft(circuit, R)
+        for k in range(len(B)):
+            phase_add_mod_constant(circuit=circuit, N=N, a=X * 2**k % N, B=R, AUX=AUX, controls=[B[k]] + list(controls))
+        inverse_qft(circuit, R)
+    elif adder == "cuccaro":
+        for k in range(len(B)):
+            add_mod_constant(circuit=circuit, N=N, a=X * 2**k % N, B=R, AUX=AUX, controls=[B[k]] + list(controls), gate_library=gate_library)
+    else:
+        raise ValueError(f"multiply_mod_constant needs the cuccaro or draper adder, not {adder}")
 
 
-def multiply_mod_fixed_power_2_k(circuit, N, X, B, AUX, k):
-    # Needs len(AUX) = 9 len (X) + 6
-    
-    if int(N, 2) == 0:
-        W = 0
-    else:
-        W = pow(int(X, 2), 2**k, int(N, 2))  # built-in pow(base, exp, mod)
+def multiply_mod_fixed_constant(circuit, N, X, B, AUX, reset_free=False, adder="draper", controls=(), gate_library="standard"):
+    # B <- B*X mod N like multiply_mod_fixed, but N is classical too, so no register holds X or N
+    # B must hold a value < N, and X must be invertible mod N if reset_free
+    # With controls, B is only multiplied if all the controls are 1; this needs reset_free, so that the
+    # multiplication stays unitary when the controls are in superposition
+    # Needs len(AUX) = len(B)+2 (2 len(B)+4 if adder is "cuccaro")
+
+    N, X = to_int(N), to_int(X)
+    if N == 0:
+        raise ValueError("multiply_mod_fixed_constant needs N > 0")
+    if controls and not reset_free:
+        raise ValueError("multiply_mod_fixed_constant needs reset_free with controls")
+
+    if not reset_free:
+        reset_bits(circuit=circuit, bits=AUX)
 
-    W_binary = format(W, '0' + str(len(B)) + 'b')  # convert W to binary string
+    result_register = AUX[:len(B)+1]
+    multiply_aux = AUX[len(B)+1:]
 
-    N_register = AUX[:len(N)]
-    mul_mod_fixed_aux = AUX[len(N):]
+    multiply_mod_constant(circuit=circuit, N=N, X=X, B=B, R=result_register, AUX=multiply_aux, adder=adder, controls=controls, gate_library=gate_library)
 
-    set_bits(circuit=circuit, A=N_register, X="".join(reversed(N)))
+    if reset_free:
+        X_inverse = pow(X, -1, N) # raises ValueError if X is not invertible mod N
+
+        for i in range(len(B)):
+            if controls:
+                # controlled swap: CX, a Toffoli controlled by the controls too, CX
+                circuit.cx(result_register[i], B[i])
+                circuit.mcx(list(controls) + [B[i]], result_register[i])
+                circuit.cx(result_register[i], B[i])
+            else:
+                circuit.swap(B[i], result_register[i])
+
+        # B*X^-1 = old B is subtracted from the result register, which returns it to |0>
+        block = circuit.copy_empty_like()
+        multiply_mod_constant(circuit=block, N=N, X=X_inverse, B=B, R=result_register, AUX=multiply_aux, adder=adder, controls=controls, gate_library=gate_library)
+        circuit.compose(block.inverse(), inplace=True)
+        return
+
+    reset_bits(circuit=circuit, bits=B)
+    copy(circuit=circuit, A=result_register[:len(B)], B=B)
 
-    multiply_mod_fixed(circuit=circuit, N=N_register, X=W_binary, B=B, AUX=mul_mod_fixed_aux) # B * W mod N
     reset_bits(circuit=circuit, bits=AUX)
 
 
-def multiply_mod_fixed_power_Y(circuit,N,X,B,AUX,Y):
-    # Needs len(AUX) = 9 len (X) + 6
-    
-    for i in range(len("".join(reversed(Y)))):
-        if Y[i] == "1":
-            multiply_mod_fixed_power_2_k(circuit=circuit, N=N, X=X, B=B, AUX=AUX, k=i)
+def multiply_mod_fixed_power_2_k(circuit, N, X, B, AUX, k, reset_free=False, adder="ripple", constant=False, reduction="doubling", controls=(), gate_library="standard"):
+    # Needs len(AUX) = 9 len (X) + 6 (2 len(X)^2 + 6 len(X) + 6 if reset_free)
+    # with adder "cuccaro": len(AUX) = 5 len(X) + 2 (2 len(X)^2 + 5 len(X) + 5 if reset_free)
+    # with adder "draper": len(AUX) = 6 len(X) + 2 (2 len(X)^2 + 6 len(X) + 6 if reset_free)
+    # if constant: len(AUX) = len(X) + 2 with adder "draper", 2 len(X) + 4 with adder "cuccaro"
+    # with reduction "montgomery": len(AUX) = 6 len(X) + 15, 4 len(X) + 7 with adder "cuccaro", 5 len(X) + 9 with adder "draper"
+    # with controls, see multiply_mod_fixed_power
+
+    multiply_mod_fixed_power(circuit=circuit, N=N, X=X, B=B, AUX=AUX, e=2**k, reset_free=reset_free, adder=adder, constant=constant, reduction=reduction, controls=controls, gate_library=gate_library)
 
+
+def multiply_mod_fixed_power(circuit, N, X, B, AUX, e, reset_free=False, adder="ripple", constant=False, reduction="doubling", controls=(), gate_library="standard"):
+    # B <- B * X^e mod N for a classical exponent e (an int), with a single multiplication by W = X^e mod N
+    # Needs the same AUX as multiply_mod_fixed_power_2_k
+    # N and X are classical, N of len(B) bits, see registers.py
+    # if reset_free, B must hold a value < N: the ancillas are only returned to |0> then
+    # With controls, B is only multiplied if all the controls are 1 (e.g. a qubit of an exponent in superposition,
+    # see order_finding.py): only with constant and reset_free, the mode that resets nothing B is entangled with
+
+    if controls and not (constant and reset_free):
+        raise ValueError("multiply_mod_fixed_power needs constant and reset_free with controls")
+
+    N_value = to_int(N)
+    if N_value == 0:
+        W = 0
+    else:
+        W = pow(to_int(X), e, N_value)  # built-in pow(base, exp, mod)
+
+    if reduction == "montgomery":
+        if constant:
+            raise ValueError("the montgomery reduction is not available with constant")
+        if N_value % 2 == 0:
+            raise ValueError("the montgomery reduction needs an odd N")
+        # the multiplier divides by 2^len(B), so it is given W in Montgomery form
+        W = W * 2**len(B) % N_value
+
+    if isinstance(AUX, AncillaAllocator) and (constant or reset_free or adder != "ripple"):
+        # only the ripple adder in reset mode borrows step by step, the others get their whole AUX at once
+        with_ancillas(circuit, AUX, multiply_mod_fixed_power_Y_aux_size(len(B), reset_free=reset_free, adder=adder, constant=constant, reduction=reduction), reset=not reset_free,
+                      call=lambda AUX: multiply_mod_fixed_power(circuit=circuit, N=N, X=X, B=B, AUX=AUX, e=e, reset_free=reset_free, adder=adder, constant=constant, reduction=reduction, controls=controls, gate_library=gate_library))
+        return
+
+    if constant:
+        multiply_mod_fixed_constant(circuit=circuit, N=N, X=W, B=B, AUX=AUX, reset_free=reset_free, adder=adder, controls=controls, gate_library=gate_library) # B * W mod N
+        return
+
+    # nothing is reset before N is loaded, so that the reset-free mode can use the same register
+    (N_register,), mul_mod_fixed_aux = take_registers(circuit, AUX, len(B), reset=False)
+    load_register(circuit=circuit, A=N_register, value=N_value)
+
+    if reset_free:
+        W_inverse = pow(W, -1, N_value) # raises ValueError if W is not invertible mod N
+
+        multiply_mod_fixed(circuit=circuit, N=N_register, X=W, B=B, AUX=mul_mod_fixed_aux, reset_free=True, X_inverse=W_inverse, adder=adder, reduction=reduction, gate_library=gate_library) # B * W mod N
+        load_register(circuit=circuit, A=N_register, value=N_value) # -> |0>
+        return
+
+    multiply_mod_fixed(circuit=circuit, N=N_register, X=W, B=B, AUX=mul_mod_fixed_aux, adder=adder, reduction=reduction, gate_library=gate_library) # B * W mod N
+    release_registers(circuit=circuit, AUX=AUX, registers=[N_register])
+
+
+def multiply_mod_fixed_power_Y(circuit,N,X,B,AUX,Y,reset_free=False,adder="ripple",constant=False,window=1,reduction="doubling",gate_library="standard"):
+    # Needs len(AUX) = 9 len (X) + 6 (2 len(X)^2 + 6 len(X) + 6 if reset_free)
+    # with adder "cuccaro": len(AUX) = 5 len(X) + 2 (2 len(X)^2 + 5 len(X) + 5 if reset_free)
+    # with adder "draper": len(AUX) = 6 len(X) + 2 (2 len(X)^2 + 6 len(X) + 6 if reset_free)
+    # if constant: len(AUX) = len(X) + 2 with adder "draper", 2 len(X) + 4 with adder "cuccaro"
+    # with reduction "montgomery": len(AUX) = 6 len(X) + 15, 4 len(X) + 7 with adder "cuccaro", 5 len(X) + 9 with adder "draper";
+    # the result is then exact, but N must be odd
+    # Y is split in windows of window bits: a window with value j at bit k multiplies once by X^(j*2^k) mod N,
+    # so there are about len(Y)/window multiplications instead of one per set bit. window=None takes all of Y at once.
+    # Y is classical, so the table entry of each window is chosen while building and costs no qubits
+    # reset_free keeps the circuit unitary (no reset, every ancilla back to |0>), for circuits that must stay coherent
+    # like phase estimation. It is never cheaper: 2 len(X)^2 + 6 len(X) + 6 ancillas instead of 9 len(X) + 6, and
+    # about 7 times the CX gates of reset mode once transpiled (ripple and cuccaro adders, len(X) = 3 and 4).
+    # With constant it costs no extra qubits, see multiply_mod_fixed_constant.
+    # gate_library picks how the controlled gates are built, see gates.py
+
+    check_gate_library(gate_library)
+    Y_value = to_int(Y)
+    if window is None:
+        window = max(Y_value.bit_length(), 1)
+
+    for k in range(0, Y_value.bit_length(), window):
+        j = (Y_value >> k) % 2**window
+        if j != 0:
+            multiply_mod_fixed_power(circuit=circuit, N=N, X=X, B=B, AUX=AUX, e=j * 2**k, reset_free=reset_free, adder=adder, constant=constant, reduction=reduction, gate_library=gate_library)
+
+
+def multiply_mod_fixed_power_Y_aux_size(n, reset_free=False, adder="ripple", constant=False, reduction="doubling"):
+    # len(AUX) needed by multiply_mod_fixed_power_Y (and multiply_mod_fixed_power_2_k) for len(X) = n
+
+    if constant:
+        return 2*n + 4 if adder == "cuccaro" else n + 2
+    if reduction == "montgomery":
+        return {"ripple": 6*n + 15, "cuccaro": 4*n + 7, "draper": 5*n + 9}[adder]
+    if adder == "cuccaro":
+        return 2*n**2 + 5*n + 5 if reset_free else 5*n + 2
+    if adder == "draper":
+        return 2*n**2 + 6*n + 6 if reset_free else 6*n + 2
+    return 2*n**2 + 6*n + 6 if reset_free else 9*n + 6
@@ -1,3 +1,19 @@
+# The controlled gates below come from a gate library, chosen per call with gate_library
+# (passed down by every function of functions.py that uses them, like adder):
+#  - "standard": every controlled gate is a single multi-controlled X per term
+#  - "low_cost": c AND (a XOR b) is computed with a single Toffoli by folding b into a with CX gates first,
+#    and c AND (a OR b) as c XOR (c AND NOT a AND NOT b), one CX and one open-controlled MCX instead of three MCX;
+#    controlled_full_adder (functions.py) also controls only its outputs
+# Both libraries compute the same function on every basis state, only the gate counts differ.
+
+GATE_LIBRARIES = ["standard", "low_cost"]
+
+
+def check_gate_library(name):
+    if name not in GATE_LIBRARIES:
+        raise ValueError(f"unknown gate library {name}, expected one of {GATE_LIBRARIES}")
+
+
 def and_gate(circuit, a, b, output):
     circuit.ccx(a, b, output)
 
@@ -16,12 +32,56 @@ def controlled_and_gate(circuit, c, a, b, output):
     circuit.mcx([c, a, b], output)
 
 
-def controlled_or_gate(circuit, c, a, b, output):
+def controlled_or_gate(circuit, c, a, b, output, gate_library="standard"):
+    if gate_library == "low_cost":
+        circuit.cx(c, output)
+        circuit.mcx([c, a, b], output, ctrl_state="001") # c AND NOT a AND NOT b, ctrl_state lists c last
+        return
+
     circuit.mcx([c, a], output)
     circuit.mcx([c, b], output)
     circuit.mcx([c, a, b], output)
 
 
-def controlled_xor_gate(circuit, c, a, b, output):
+def controlled_xor_gate(circuit, c, a, b, output, gate_library="standard"):
+    if gate_library == "low_cost":
+        # a is restored, so it can be any qubit but c and output
+        circuit.cx(b, a)
+        circuit.ccx(c, a, output)
+        circuit.cx(b, a)
+        return
+
     circuit.mcx([c, a], output)
-    circuit.mcx([c, b], output)
\ No newline at end of file
+    circuit.mcx([c, b], output)
+
+
+def majority_gate(circuit, a, b, c, output):
+    circuit.ccx(a, b, output)
+    circuit.ccx(a, c, output)
+    circuit.ccx(b, c, output)
+
+
+def maj_gate(circuit, c_in, b, a):
+    # a <- majority(a, b, c_in), b <- b xor a, c_in <- c_in xor a
+    circuit.cx(a, b)
+    circuit.cx(a, c_in)
+    circuit.ccx(c_in, b, a)
+
+
+def uma_gate(circuit, c_in, b, a):
+    # undoes maj_gate on a and c_in, leaves the sum bit in b
+    circuit.ccx(c_in, b, a)
+    circuit.cx(a, c_in)
+    circuit.cx(c_in, b)
+
+
+def controlled_uma_gate(circuit, c, c_in, b, a, gate_library="standard"):
+    # like uma_gate, but b gets the sum bit only if c is 1 (b is restored otherwise)
+    circuit.ccx(c_in, b, a)
+    circuit.cx(a, c_in)
+    circuit.cx(a, b)
+    if gate_library == "low_cost":
+        controlled_xor_gate(circuit=circuit, c=c, a=a, b=c_in, output=b, gate_library=gate_library)
+        return
+    circuit.ccx(c, a, b)
+    circuit.ccx(c, c_in, b)
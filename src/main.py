@@ -1,41 +1,47 @@
-from qiskit import QuantumCircuit, transpile
-from qiskit_aer import AerSimulator
-from utilities import *
-from functions import *
+from cache import CircuitCache, cached_power_Y_circuit
+from backends import select_backend
 
-backend = AerSimulator()
+# Demo: computes b * x^y mod n for the settings below and prints the counts, run with
+#   python main.py
+# Importing this module does nothing else; the library is in api.py (see there for what goes where).
 
-## CREATE CIRCUIT
+## SETTINGS
 b = "10"
 n = "11"
 x = "10"
 y = "00"
+adder = "ripple" # "ripple" needs 8n+1+max(5, n+1) ancillas, "cuccaro" 5n+2, "draper" 6n+2
+constant = False # N and X as classical constants, only with "cuccaro" (2n+4 ancillas) or "draper" (n+2), needs b < n
+reset_free = False # no resets, needs b < n: 2n^2+6n+6 ancillas and ~7x the CX gates, only for circuits that must stay coherent (free with constant)
+window = 1 # bits of y per multiplication, None for all of y at once
+reduction = "doubling" # "montgomery" avoids a comparison per bit of b and gives the exact result, needs an odd n
+gate_library = "standard" # "low_cost" builds the controlled gates with fewer Toffolis, see gates.py
+optimize = True # removes the redundant gates of the arithmetic before transpiling, see peephole.py
 
-print(f"Doing {int(b,2)} * {int(x,2)}^{int(y,2)} mod {int(n,2)}")
-print(f"Expected result: {int(b,2) * int(x,2)**int(y,2) % int(n,2)}")
 
-B_register = range(len(b))
+def main():
+    print(f"Doing {int(b,2)} * {int(x,2)}^{int(y,2)} mod {int(n,2)}")
+    print(f"Expected result: {int(b,2) * int(x,2)**int(y,2) % int(n,2)}")
 
-AUX = range(len(n), len(n)+(9 * len(n) + 6))
+    cache_directory = None # e.g. ".circuit_cache" to reuse built and transpiled circuits between runs
+    cache = CircuitCache(directory=cache_directory)
 
-n_qubits = (8*len(n)+6) + (2*len(n))
+    circuit = cached_power_Y_circuit(cache, b=b, N=n, X=x, Y=y, reset_free=reset_free, adder=adder, constant=constant, window=window, reduction=reduction, optimize=optimize, gate_library=gate_library) # the ancillas are allocated as needed
+    print(f"Running circuit({circuit.num_qubits}, {circuit.num_clbits})")
 
-circuit = QuantumCircuit(n_qubits, len(b))
+    ## COMPILE AND RUN
+    memory_limit = None # bytes the simulation may use, all the available memory if None
+    backend = select_backend(circuit, memory_limit=memory_limit)
+    transpiled_circuit = cached_power_Y_circuit(cache, b=b, N=n, X=x, Y=y, backend=backend, reset_free=reset_free, adder=adder, constant=constant, window=window, reduction=reduction, optimize=optimize, gate_library=gate_library)
+    n_shots = 1
+    job_sim = backend.run(transpiled_circuit, shots = n_shots)
 
-set_bits(circuit=circuit, A=B_register, X="".join(reversed(b)))
+    result_sim = job_sim.result()
+    counts = result_sim.get_counts(transpiled_circuit)
+    probs = {key:value/n_shots for key,value in counts.items()}
+    print("Counts: ", counts)
+    print("Probabilities: ", probs)
 
-multiply_mod_fixed_power_Y(circuit=circuit, N=n, X=x, B=B_register, AUX=AUX, Y=y)
 
-circuit.measure(B_register, range(len(b)))
-print(f"Running circuit({n_qubits}, {len(b)})")
-
-## COMPILE AND RUN
-transpiled_circuit = transpile(circuit, backend)
-n_shots = 1
-job_sim = backend.run(transpiled_circuit, shots = n_shots)
-
-result_sim = job_sim.result()
-counts = result_sim.get_counts(transpiled_circuit)
-probs = {key:value/n_shots for key,value in counts.items()}
-print("Counts: ", counts)
-print("Probabilities: ", probs)
+if __name__ == "__main__":
+    main()
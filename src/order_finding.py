@@ -0,0 +1,117 @@
+from fractions import Fraction
+from math import gcd, lcm, pi
+from qiskit import QuantumCircuit
+from utilities import *
+from functions import *
+from backends import select_backend
+from cache import transpile_for
+
+# Order finding (the quantum part of Shor's algorithm): the smallest r > 0 with X^r = 1 mod N.
+# The exponent register E of m qubits is put in superposition and E[k] controls B <- B * X^(2^k) mod N
+# (multiply_mod_fixed_power_2_k with controls), so a single run computes X^e mod N for every e at once.
+# The inverse QFT of E then gives y close to s * 2^m / r for a random s, and r is the denominator of the
+# continued-fraction approximation of y / 2^m; the denominators of a few shots are combined with lcm.
+# The multiplications use the constant, reset-free multiplier (Beauregard), the only one that is unitary.
+# semiclassical=True replaces E with a single control qubit that is measured and reused for every bit of the
+# exponent (Griffiths-Niu): the inverse QFT becomes H gates and phase corrections conditioned on the bits
+# already measured, so the circuit has m-1 qubits fewer and gives the same distribution of y.
+
+
+def order_finding_circuit(N, X, m=None, adder="draper", semiclassical=False, gate_library="standard"):
+    # Circuit measuring y ~ s * 2^m / r into its m classical bits; N and X as in registers.py, X coprime to N
+    # qubits: E = 0..m-1 (a single control qubit 0 if semiclassical), then B (n = register_width(N) qubits,
+    # starts at 1), then the AUX of the multiplier
+    # m is 2n by default, enough to tell the fractions s/r with r < N apart
+    n = register_width(N)
+    N_value, X_value = to_int(N), to_int(X)
+    if N_value < 2 or gcd(X_value, N_value) != 1:
+        raise ValueError(f"order finding needs N > 1 and X coprime to N, got N = {N_value}, X = {X_value}")
+    if m is None:
+        m = 2 * n
+
+    aux_size = multiply_mod_fixed_power_Y_aux_size(n, reset_free=True, adder=adder, constant=True)
+    if semiclassical:
+        return _semiclassical_order_finding_circuit(N, X_value, m, n, aux_size, adder, gate_library)
+
+    circuit = QuantumCircuit(m + n + aux_size, m)
+    E = list(range(m))
+    B = list(range(m, m + n))
+    AUX = list(range(m + n, m + n + aux_size))
+
+    load_register(circuit=circuit, A=B, value=1)
+    for k in range(m):
+        circuit.h(E[k])
+    for k in range(m):
+        multiply_mod_fixed_power_2_k(circuit=circuit, N=N, X=X_value, B=B, AUX=AUX, k=k, reset_free=True, adder=adder, constant=True, controls=[E[k]], gate_library=gate_library)
+
+    # E[k] has the phase 2 pi y 2^k / 2^m, i.e. E reversed is the QFT of y (see qft)
+    inverse_qft(circuit, E[::-1])
+    circuit.measure(E[::-1], range(m))
+
+    return circuit
+
+
+def _semiclassical_order_finding_circuit(N, X, m, n, aux_size, adder, gate_library):
+    circuit = QuantumCircuit(1 + n + aux_size, m)
+    control = 0
+    B = list(range(1, 1 + n))
+    AUX = list(range(1 + n, 1 + n + aux_size))
+
+    load_register(circuit=circuit, A=B, value=1)
+
+    # bit i of y is read from the exponent qubit k = m-1-i, whose phase 2 pi y / 2^(i+1) also holds
+    # the bits below i: they were measured already and are rotated away before the H
+    for i in range(m):
+        k = m - 1 - i
+        circuit.reset(control)
+        circuit.h(control)
+        multiply_mod_fixed_power_2_k(circuit=circuit, N=N, X=X, B=B, AUX=AUX, k=k, reset_free=True, adder=adder, constant=True, controls=[control], gate_library=gate_library)
+        for l in range(i):
+            with circuit.if_test((circuit.clbits[l], 1)):
+                circuit.p(-pi / 2**(i-l), control)
+        circuit.h(control)
+        circuit.measure(control, i)
+
+    return circuit
+
+
+def order_from_measurement(y, m, N):
+    # the denominator of the fraction closest to y / 2^m with a denominator of at most N
+    return Fraction(y, 2**m).limit_denominator(to_int(N)).denominator
+
+
+def reduce_order(X, r, N):
+    # the order of X mod N from a multiple r of it: divides r by each of its prime factors p while X^(r/p) = 1 mod N
+    X_value, N_value = to_int(X), to_int(N)
+    rest = r
+    p = 2
+    while rest > 1:
+        if p * p > rest:
+            p = rest
+        if rest % p == 0:
+            while rest % p == 0:
+                rest //= p
+            while r % p == 0 and pow(X_value, r // p, N_value) == 1:
+                r //= p
+        p += 1
+    return r
+
+
+def find_order(N, X, backend=None, shots=16, m=None, adder="draper", semiclassical=False, gate_library="standard", **run_options):
+    # Runs order_finding_circuit and returns the order of X mod N, or None if the shots did not give it;
+    # backend=None picks one with select_backend, run_options go to backend.run (e.g. seed_simulator)
+    N_value, X_value = to_int(N), to_int(X)
+    circuit = order_finding_circuit(N, X, m=m, adder=adder, semiclassical=semiclassical, gate_library=gate_library)
+    m = circuit.num_clbits
+
+    if backend is None:
+        backend = select_backend(circuit, report=False)
+    counts = backend.run(transpile_for(circuit, backend), shots=shots, **run_options).result().get_counts(0)
+
+    r = 1
+    for outcome in sorted(counts, key=counts.get, reverse=True):
+        r = lcm(r, order_from_measurement(int(outcome, 2), m, N_value))
+        if pow(X_value, r, N_value) == 1:
+            # the lcm of the denominators can be a multiple of the order
+            return reduce_order(X_value, r, N_value)
+    return None
@@ -0,0 +1,150 @@
+from qiskit.circuit import ControlledGate
+from qiskit.circuit.library import XGate
+
+# Peephole optimizer for the circuits built by functions.py. It removes what the helpers emit
+# without looking at their neighbours:
+#  - adjacent inverse pairs on the same qubits (x x, cx cx, the cp ladders of an inverse_qft followed by a qft, ...)
+#  - a reset right after a reset, and single-qubit gates whose result is reset right away
+#  - the barriers of copy()
+#  - x(c) ... x(c) around gates that only use c as a control: the X gates are folded into open controls
+# Each instruction is compared with the last instruction on its qubits only, so one pass is linear in the size
+# of the circuit; passes are repeated until nothing changes, because a fold can make two gates adjacent.
+
+SELF_INVERSE = {"x", "y", "z", "h", "cx", "cy", "cz", "ccx", "mcx", "swap"}
+SYMMETRIC = {"cz", "cp", "swap"}
+
+
+def _is_mcx(operation):
+    return isinstance(operation, ControlledGate) and operation.base_gate.name == "x"
+
+
+def _is_inverse(first, second):
+    # True if the gate second undoes first, both are (operation, qubits, clbits)
+    operation_1, qubits_1, _ = first
+    operation_2, qubits_2, _ = second
+
+    if operation_1.name != operation_2.name or operation_1.name in ("reset", "measure", "barrier"):
+        return False
+    if operation_1.name in SYMMETRIC:
+        if set(qubits_1) != set(qubits_2):
+            return False
+    elif qubits_1 != qubits_2:
+        return False
+
+    if operation_1.name in SELF_INVERSE or _is_mcx(operation_1):
+        return operation_1 == operation_2
+    try:
+        return operation_1.inverse() == operation_2
+    except Exception: # no inverse, e.g. gates with unbound parameters in a non-invertible form
+        return False
+
+
+def _with_open_control(operation, position):
+    # the same multi-controlled X, with the control at position (0 is the first control) flipped
+    ctrl_state = operation.ctrl_state ^ (1 << position)
+    return XGate().control(operation.num_ctrl_qubits, ctrl_state=ctrl_state)
+
+
+def _fold(kept, stack, control, remove):
+    # folds the X gate on control that is about to be added into the last one on control, if only
+    # multi-controlled X gates that use control as a control are in between; returns True if it did
+    between = []
+    for index in reversed(stack):
+        operation, qubits, _ = kept[index]
+        if operation.name == "x":
+            if not between:
+                return False
+            for position, gate_index in between:
+                gate = kept[gate_index]
+                kept[gate_index] = [_with_open_control(gate[0], position), gate[1], gate[2]]
+            remove(index)
+            return True
+        if not _is_mcx(operation) or control not in qubits[:-1]:
+            return False
+        between.append((list(qubits).index(control), index))
+    return False
+
+
+def _pass(instructions, report):
+    # one sweep over instructions (a list of [operation, qubits, clbits]), returns the kept ones
+    kept = []      # None where an instruction was removed
+    last = {}      # wire -> stack of indices in kept of the live instructions on it
+
+    def wires(instruction):
+        return list(instruction[1]) + [("clbit", clbit) for clbit in instruction[2]]
+
+    def top(wire):
+        stack = last.get(wire)
+        return stack[-1] if stack else None
+
+    def remove(index):
+        for wire in wires(kept[index]):
+            if last[wire][-1] == index:
+                last[wire].pop()
+            else:
+                last[wire].remove(index)
+        kept[index] = None
+
+    for instruction in instructions:
+        operation, qubits, clbits = instruction
+
+        if operation.name == "barrier":
+            report["barriers"] += 1
+            continue
+
+        if operation.name == "reset":
+            qubit = qubits[0]
+            # a single-qubit gate right before a reset is lost anyway
+            while top(qubit) is not None and kept[top(qubit)][0].name not in ("reset", "measure") and len(wires(kept[top(qubit)])) == 1:
+                remove(top(qubit))
+                report["dead"] += 1
+            if top(qubit) is not None and kept[top(qubit)][0].name == "reset":
+                report["resets"] += 1
+                continue
+
+        instruction_wires = wires(instruction)
+        candidate = top(instruction_wires[0])
+        if candidate is not None and all(top(wire) == candidate for wire in instruction_wires) \
+                and len(wires(kept[candidate])) == len(instruction_wires) and _is_inverse(kept[candidate], instruction):
+            remove(candidate)
+            report["cancelled"] += 1
+            continue
+
+        if operation.name == "x" and _fold(kept, last.get(qubits[0], []), qubits[0], remove):
+            # x(c) <gates controlled by c> x(c): the control of c is opened in the gates in between
+            report["folded"] += 1
+            continue
+
+        kept.append([operation, qubits, clbits])
+        for wire in instruction_wires:
+            last.setdefault(wire, []).append(len(kept) - 1)
+
+    return [instruction for instruction in kept if instruction is not None]
+
+
+def optimize_circuit(circuit, max_passes=10):
+    # Returns (optimized copy of circuit, report), see format_report
+    instructions = [[instruction.operation, tuple(circuit.find_bit(qubit).index for qubit in instruction.qubits),
+                     tuple(circuit.find_bit(clbit).index for clbit in instruction.clbits)] for instruction in circuit.data]
+    report = {"cancelled": 0, "resets": 0, "dead": 0, "barriers": 0, "folded": 0, "passes": 0}
+
+    for _ in range(max_passes):
+        size = len(instructions)
+        instructions = _pass(instructions, report)
+        report["passes"] += 1
+        if len(instructions) == size:
+            break
+
+    optimized = circuit.copy_empty_like()
+    for operation, qubits, clbits in instructions:
+        optimized.append(operation, [optimized.qubits[qubit] for qubit in qubits], [optimized.clbits[clbit] for clbit in clbits])
+
+    report["before"] = dict(circuit.count_ops())
+    report["after"] = dict(optimized.count_ops())
+    report["saved"] = circuit.size() - optimized.size()
+    return optimized, report
+
+
+def format_report(report):
+    return (f"{report['saved']} gates saved: {report['cancelled']} inverse pairs, {report['folded']} X pairs folded into controls, "
+            f"{report['resets']} repeated resets, {report['dead']} gates before a reset, {report['barriers']} barriers")
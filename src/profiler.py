@@ -0,0 +1,158 @@
+import sys
+import time
+from collections import Counter
+from functools import wraps
+from inspect import signature
+import functions
+import gates
+import utilities
+
+# Opt-in profiler for the circuits built by functions.py. While a Profiler is active, every function of
+# functions.py, gates.py and utilities.py that takes the circuit as its first argument is wrapped, and each
+# call is recorded in a call tree: the gates it appended (by name), the qubits they touched and the build time.
+#   with Profiler() as profiler:
+#       circuit = build_power_Y_core(N, X, Y)
+#   print(format_profile(profiler))
+#   profiler.write_collapsed("build.folded", metric="gates")  # for flamegraph.pl, speedscope, ...
+# The calls with the same path from the root are merged into one node. The counts of a node include its
+# children; the self counts are what is left once the children are taken out. compute_uncompute builds
+# the computation in a separate block and appends it twice, so its self gates are the uncomputation.
+# The functions are swapped in every loaded module that imported them, so only one Profiler can run at a time.
+
+PROFILED_MODULES = [functions, gates, utilities]
+
+
+class ProfileNode:
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.time = 0.0            # seconds, children included
+        self.gates = Counter()     # children included
+        self.qubits = set()        # indices of the qubits touched by the gates, children included
+        self.children = {}
+
+    def child(self, name):
+        if name not in self.children:
+            self.children[name] = ProfileNode(name)
+        return self.children[name]
+
+    def self_gates(self):
+        gates = Counter(self.gates)
+        for child in self.children.values():
+            gates.subtract(child.gates)
+        return +gates
+
+    def self_time(self):
+        return max(self.time - sum(child.time for child in self.children.values()), 0.0)
+
+
+def _profiled_functions():
+    # {function: name} of the functions that build on the circuit given as their first argument
+    found = {}
+    for module in PROFILED_MODULES:
+        for name, value in vars(module).items():
+            if callable(value) and getattr(value, "__module__", None) == module.__name__ and not isinstance(value, type):
+                parameters = list(signature(value).parameters)
+                if parameters and parameters[0] == "circuit":
+                    found[value] = name
+    return found
+
+
+class Profiler:
+
+    _active = None
+
+    def __init__(self):
+        self.root = ProfileNode("root")
+        self._stack = [self.root]
+        self._patched = [] # (module dict, name, original)
+
+    def _wrap(self, function, name):
+        @wraps(function)
+        def profiled(*args, **kwargs):
+            circuit = kwargs["circuit"] if "circuit" in kwargs else args[0]
+            node = self._stack[-1].child(name)
+            self._stack.append(node)
+            start_size = len(circuit.data)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                node.time += time.perf_counter() - start
+                node.calls += 1
+                for instruction in circuit.data[start_size:]:
+                    node.gates[instruction.operation.name] += 1
+                    node.qubits.update(circuit.find_bit(qubit).index for qubit in instruction.qubits)
+                self._stack.pop()
+        return profiled
+
+    def start(self):
+        if Profiler._active is not None:
+            raise RuntimeError("another Profiler is already running")
+        Profiler._active = self
+
+        wrappers = {id(function): (function, self._wrap(function, name)) for function, name in _profiled_functions().items()}
+        for module in list(sys.modules.values()):
+            namespace = getattr(module, "__dict__", None)
+            if not isinstance(namespace, dict):
+                continue
+            for name, value in list(namespace.items()):
+                function, wrapper = wrappers.get(id(value), (None, None))
+                if function is value:
+                    namespace[name] = wrapper
+                    self._patched.append((namespace, name, value))
+        return self
+
+    def stop(self):
+        for namespace, name, original in reversed(self._patched):
+            namespace[name] = original
+        self._patched = []
+        Profiler._active = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exception):
+        self.stop()
+        return False
+
+    def nodes(self):
+        # (path, node) for every node of the call tree, depth first; path is the tuple of names from the root
+        def walk(node, path):
+            for child in node.children.values():
+                yield path + (child.name,), child
+                yield from walk(child, path + (child.name,))
+        return list(walk(self.root, ()))
+
+    def collapsed_stacks(self, metric="gates"):
+        # Lines "f;g;h value" (the collapsed stack format of flamegraph.pl) with the self value of every node:
+        # metric is "gates" (all gates), "time" (microseconds), "calls", or a gate name like "ccx"
+        lines = []
+        for path, node in self.nodes():
+            if metric == "gates":
+                value = sum(node.self_gates().values())
+            elif metric == "time":
+                value = round(node.self_time() * 1e6)
+            elif metric == "calls":
+                value = node.calls
+            else:
+                value = node.self_gates()[metric]
+            if value:
+                lines.append(f"{';'.join(path)} {value}")
+        return lines
+
+    def write_collapsed(self, path, metric="gates"):
+        with open(path, "w") as file:
+            file.write("\n".join(self.collapsed_stacks(metric=metric)) + "\n")
+
+
+def format_profile(profiler, max_depth=None):
+    lines = [f"{'function':50} {'calls':>7} {'gates':>9} {'self gates':>10} {'qubits':>7} {'ms':>10} {'self ms':>10}"]
+    for path, node in profiler.nodes():
+        if max_depth is not None and len(path) > max_depth:
+            continue
+        name = "  " * (len(path) - 1) + node.name
+        lines.append(f"{name:50} {node.calls:>7} {sum(node.gates.values()):>9} {sum(node.self_gates().values()):>10} {len(node.qubits):>7} "
+                     f"{node.time * 1e3:>10.2f} {node.self_time() * 1e3:>10.2f}")
+    return "\n".join(lines)
@@ -0,0 +1,199 @@
+import numpy as np
+
+# Classical model of the circuits in functions.py, over whole arrays of inputs at once.
+# Values are plain ints (not binary strings), n is the width of the registers.
+# Every function reproduces what the circuit measures, including the truncation to n bits:
+# add_mod only subtracts N once, multiply_mod does not reduce the sum of its partial products mod N.
+# The reset-free and constant multipliers are exact, see multiply_mod_fixed_power.
+# The arrays hold Python ints (dtype object), so the products are exact at any n, not only below 32 bits.
+
+
+def _array(X):
+    return np.asarray(X).astype(object)
+
+
+def add(A, B, n):
+    return (_array(A) + _array(B)) % 2**n
+
+
+def subtract(A, B, n):
+    return (_array(A) - _array(B)) % 2**n
+
+
+def greater_than_or_equal(A, B):
+    return (_array(A) >= _array(B)).astype(np.int64)
+
+
+def greater_than(A, B):
+    return (_array(A) > _array(B)).astype(np.int64)
+
+
+def add_mod(N, A, B, n):
+    N = _array(N)
+    R = add(A, B, n)
+    return np.where(R >= N, R - N, R)
+
+
+def times_two_mod(N, A, n):
+    return add_mod(N, A, A, n)
+
+
+def times_two_power_mod(N, A, k, n):
+    if k == 0:
+        # A mod N, with a single conditional subtraction
+        return add_mod(N, A, 0, n)
+
+    R = _array(A)
+    for _ in range(k):
+        R = times_two_mod(N, R, n)
+    return R
+
+
+def multiply_mod(N, A, B, n, m=None, reduction="doubling"):
+    # m is the width of B, n by default
+    if m is None:
+        m = n
+
+    if reduction == "montgomery":
+        return multiply_mod_montgomery(N, A, B, n, m)
+
+    B = _array(B)
+    R = np.zeros(np.broadcast(_array(N), _array(A), B).shape, dtype=object)
+    doubled = _array(A)
+
+    for k in range(m):
+        if k == 0:
+            term = times_two_power_mod(N, A, 0, n)
+        else:
+            doubled = times_two_mod(N, doubled, n)
+            term = doubled
+        R = np.where((B >> k) & 1, (R + term) % 2**n, R)
+
+    return R
+
+
+def multiply_mod_montgomery(N, A, B, n, m=None):
+    # A * B * 2^-m mod N when N is odd and A < N; the accumulator has n+2 bits and is halved by a rotation
+    if m is None:
+        m = n
+
+    N, B = _array(N), _array(B)
+    T = np.zeros(np.broadcast(N, _array(A), B).shape, dtype=object)
+
+    for k in range(m):
+        T = np.where((B >> k) & 1, (T + A) % 2**(n+2), T)
+        T = np.where(T & 1, (T + N) % 2**(n+2), T)
+        T = (T >> 1) | ((T & 1) << (n+1))
+
+    return np.where(T >= N, T - N, T) % 2**n
+
+
+def power_mod(X, e, N):
+    # X^e mod N element-wise, 0 where N == 0 like multiply_mod_fixed_power_2_k
+    X, N = _array(X), _array(N)
+    safe_N = np.where(N == 0, 1, N)
+
+    R = np.ones(np.broadcast(X, N).shape, dtype=object) % safe_N
+    base = X % safe_N
+    while e > 0:
+        if e & 1:
+            R = R * base % safe_N
+        base = base * base % safe_N
+        e >>= 1
+
+    return np.where(N == 0, 0, R)
+
+
+def multiply_mod_fixed(N, X, B, n, reduction="doubling"):
+    return multiply_mod(N, X, B, n, reduction=reduction)
+
+
+def multiply_mod_fixed_power(N, X, B, e, n, constant=False, reduction="doubling", reset_free=False):
+    W = power_mod(X, e, N)
+    if constant or reset_free:
+        # the constant and the reset-free multipliers reduce exactly
+        return _array(B) * W % np.where(_array(N) == 0, 1, _array(N))
+    if reduction == "montgomery":
+        # W is loaded in Montgomery form (N is odd)
+        safe_N = np.where(_array(N) == 0, 1, _array(N))
+        W = W * (2**n % safe_N) % safe_N
+    return multiply_mod_fixed(N, W, B, n, reduction=reduction)
+
+
+def multiply_mod_fixed_power_2_k(N, X, B, k, n, constant=False, reduction="doubling", reset_free=False):
+    return multiply_mod_fixed_power(N, X, B, 2**k, n, constant=constant, reduction=reduction, reset_free=reset_free)
+
+
+def multiply_mod_fixed_power_Y(N, X, B, Y, n, constant=False, window=1, reduction="doubling", reset_free=False):
+    # Y holds ints; the window bits of Y from bit k, read as j, apply multiply_mod_fixed_power with e = j * 2^k
+    # window=None takes the whole of Y at once
+    Y = _array(Y)
+    R = _array(B)
+    R = np.broadcast_to(R, np.broadcast(_array(N), _array(X), R, Y).shape)
+
+    if window is None:
+        window = max(int(np.max(Y, initial=0)).bit_length(), 1)
+
+    k = 0
+    while np.any(Y >> k):
+        for j in np.unique((Y >> k) % 2**window):
+            if j != 0:
+                R = np.where((Y >> k) % 2**window == j, multiply_mod_fixed_power(N, X, R, int(j) * 2**k, n, constant=constant, reduction=reduction, reset_free=reset_free), R)
+        k += window
+
+    return R
+
+
+def _windows(Y, window):
+    # the exponents multiply_mod_fixed_power_Y applies for the int Y
+    if window is None:
+        window = max(Y.bit_length(), 1)
+    return [((Y >> k) % 2**window) * 2**k for k in range(0, Y.bit_length(), window) if (Y >> k) % 2**window]
+
+
+def _buildable(b, N, X, Y, reset_free, constant, window=1, reduction="doubling"):
+    # False for the inputs the circuit builders reject with a ValueError
+    if constant and N == 0:
+        return False
+    if reduction == "montgomery" and N % 2 == 0 and _windows(Y, window):
+        return False
+    if not reset_free:
+        return True
+    if b >= N:
+        # the reset-free multipliers only return their ancillas to |0> for b < N
+        return False
+
+    for e in _windows(Y, window):
+        W = 0 if N == 0 else pow(X, e, N)
+        try:
+            pow(W, -1, N)
+        except ValueError:
+            return False
+
+    return True
+
+
+def exhaustive_check(n, backend, y_width=None, cache=None, workers=1, reset_free=False, adder="ripple", constant=False, window=1, reduction="doubling", optimize=False, gate_library="standard"):
+    # Runs multiply_mod_fixed_power_Y for every b, N, X of width n and every Y of width y_width (n by default)
+    # through batch.run_batch and compares the results with this module
+    # returns the mismatches as (b, n, x, y, expected, got), binary strings and ints
+    from batch import run_batch
+
+    if y_width is None:
+        y_width = n
+
+    values = np.arange(2**n)
+    grid = np.array(np.meshgrid(values, values, values, np.arange(2**y_width), indexing="ij")).reshape(4, -1)
+
+    keep = np.array([_buildable(*map(int, row), reset_free, constant, window, reduction) for row in grid.T], dtype=bool)
+    b, N, X, Y = grid[:, keep]
+
+    expected = multiply_mod_fixed_power_Y(N, X, b, Y, n, constant=constant, window=window, reduction=reduction, reset_free=reset_free)
+
+    def binary(value, width):
+        return format(int(value), '0' + str(width) + 'b')
+
+    inputs = [(binary(b[i], n), binary(N[i], n), binary(X[i], n), binary(Y[i], y_width)) for i in range(len(b))]
+    results = run_batch(inputs, backend=backend, cache=cache, workers=workers, reset_free=reset_free, adder=adder, constant=constant, window=window, reduction=reduction, optimize=optimize, gate_library=gate_library)
+
+    return [inputs[i] + (int(expected[i]), results[inputs[i]]) for i in range(len(inputs)) if results[inputs[i]] != expected[i]]
@@ -0,0 +1,74 @@
+import numpy as np
+
+# Classical register values. The functions that take a classical operand (N, X, Y, b of the fixed-power
+# multipliers and of cache.py) accept it as
+#  - an int
+#  - a binary string, most significant bit first, as printed ("110" is 6)
+#  - a sequence or NumPy array of bits, least significant bit first, like the qubits of a register ([0, 1, 1] is 6)
+# and the conversions between them, i.e. the endianness, are only handled here.
+# The width of an int is its bit length; pass a string or an array to get a wider register.
+
+
+def to_int(value):
+    if isinstance(value, (int, np.integer)):
+        if value < 0:
+            raise ValueError(f"register values must be >= 0, got {value}")
+        return int(value)
+    if isinstance(value, str):
+        return int(value, 2) if value else 0
+    bits = np.asarray(value, dtype=np.int64)
+    if bits.ndim != 1 or np.any((bits != 0) & (bits != 1)):
+        raise ValueError("a register value given as an array must be a 1-dimensional array of bits")
+    return sum(int(bit) << j for j, bit in enumerate(bits))
+
+
+def register_width(value):
+    # the number of bits of value as given, at least 1
+    if isinstance(value, (int, np.integer)):
+        return max(int(value).bit_length(), 1)
+    return max(len(value), 1)
+
+
+def check_width(value, width, name="value"):
+    # ValueError unless value is a string or an array of width bits, or an int below 2^width
+    if isinstance(value, (int, np.integer)):
+        if to_int(value) >= 2**width:
+            raise ValueError(f"{name} = {value} does not fit in {width} bits")
+    elif len(value) != width:
+        raise ValueError(f"{name} must have {width} bits, got {len(value)}")
+
+
+def to_binary(value, width=None):
+    # binary string of value, most significant bit first, on width bits (register_width(value) by default)
+    if width is None:
+        width = register_width(value)
+    value = to_int(value)
+    if value >= 2**width:
+        raise ValueError(f"{value} does not fit in {width} bits")
+    return format(value, '0' + str(width) + 'b')
+
+
+def to_bits(value, width):
+    # bool array of the width bits of value, least significant bit first
+    value = to_int(value)
+    if value >= 2**width:
+        raise ValueError(f"{value} does not fit in {width} bits")
+    return np.array([(value >> j) & 1 for j in range(width)], dtype=bool)
+
+
+def load_register(circuit, A, value, controls=()):
+    # A <- A XOR value (A[0] is the least significant bit), only if all the controls are 1
+    value = to_int(value)
+    if value >= 2**len(A):
+        raise ValueError(f"{value} does not fit in a register of {len(A)} qubits")
+    for i in range(len(A)):
+        if (value >> i) & 1:
+            if controls:
+                circuit.mcx(list(controls), A[i])
+            else:
+                circuit.x(A[i])
+
+
+def counts_to_ints(counts_list):
+    # int64 array with the most frequent outcome of every counts dict of counts_list (e.g. one per experiment of a result)
+    return np.array([int(max(counts, key=counts.get), 2) for counts in counts_list], dtype=np.int64)
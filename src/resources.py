@@ -0,0 +1,174 @@
+from collections import Counter
+from functools import lru_cache
+from qiskit import QuantumCircuit
+from utilities import *
+from functions import *
+
+# Resources of multiply_mod_fixed_power_Y with the ripple adder in reset mode and an AncillaAllocator,
+# the circuit build_power_Y_core builds, computed without building it.
+# The estimate follows the calls of functions.py: the adders and the comparator are measured once
+# on small widths (their gate counts grow linearly with n) and everything above them is summed
+# the way the functions call them. Each call returns (gate counts, depth bound, peak ancillas);
+# the depth bound adds up the depths of consecutive calls, so it is never below the real depth.
+# The leaves are measured with the gate_library of the estimate, every cached sum is keyed by it (see gates.py).
+
+
+def _measure(function, n, gate_library):
+    # (gate counts, depth, peak ancillas) of one call of a leaf function on registers of width n
+    circuit = QuantumCircuit(3*n + 2)
+    A, B, R = range(n), range(n, 2*n), range(2*n, 3*n)
+    control, r = 3*n, 3*n + 1
+    allocator = AncillaAllocator(circuit)
+
+    if function == "add":
+        add(circuit=circuit, A=A, B=B, R=R, AUX=allocator)
+    elif function == "controlled_add":
+        controlled_add(circuit=circuit, control=control, A=A, B=B, R=R, AUX=allocator, gate_library=gate_library)
+    elif function == "controlled_subtract":
+        controlled_subtract(circuit=circuit, control=control, A=A, B=B, R=R, AUX=allocator, gate_library=gate_library)
+    elif function == "greater_than_or_equal":
+        greater_than_or_equal(circuit=circuit, A=A, B=B, r=r, AUX=allocator)
+
+    return Counter(circuit.count_ops()), circuit.depth(), allocator.peak
+
+
+@lru_cache(maxsize=None)
+def _leaf(function, n, gate_library):
+    if n <= 3:
+        return _measure(function, n, gate_library)
+
+    # the adders repeat the same block for every bit, so their cost is linear from n = 2 on
+    counts_2, depth_2, peak_2 = _leaf(function, 2, gate_library)
+    counts_3, depth_3, peak_3 = _leaf(function, 3, gate_library)
+    counts = Counter({gate: counts_2[gate] + (n-2) * (counts_3[gate] - counts_2[gate]) for gate in counts_2 | counts_3})
+    return +counts, depth_2 + (n-2) * (depth_3 - depth_2), peak_2 + (n-2) * (peak_3 - peak_2)
+
+
+def _sequence(*calls):
+    # the calls one after the other, each is (counts, depth, peak)
+    counts = Counter()
+    for call in calls:
+        counts.update(call[0])
+    return counts, sum(call[1] for call in calls), max([call[2] for call in calls], default=0)
+
+
+def _repeat(times, call):
+    # call done times times in a row
+    return Counter({gate: times * count for gate, count in call[0].items()}), times * call[1], call[2] if times else 0
+
+
+def _borrowing(k, call):
+    # call with k more ancillas live during it
+    return call[0], call[1], call[2] + k
+
+
+def _gates(depth=1, **counts):
+    return Counter(counts), depth if any(counts.values()) else 0, 0
+
+
+def _copy(n):
+    return _gates(cx=n, barrier=1)
+
+
+def _reset(n):
+    return _gates(reset=n)
+
+
+def _set_bits(value):
+    return _gates(x=bin(value).count("1"))
+
+
+@lru_cache(maxsize=None)
+def _add_mod(n, gate_library):
+    return _borrowing(n+1, _sequence(_leaf("add", n, gate_library), _leaf("greater_than_or_equal", n, gate_library), _leaf("controlled_subtract", n, gate_library), _reset(n+1)))
+
+
+@lru_cache(maxsize=None)
+def _times_two_mod(n, gate_library):
+    return _borrowing(n, _sequence(_copy(n), _add_mod(n, gate_library), _reset(n)))
+
+
+@lru_cache(maxsize=None)
+def _mod_N(n, gate_library):
+    # times_two_power_mod with k = 0
+    return _borrowing(1, _sequence(_leaf("greater_than_or_equal", n, gate_library), _leaf("controlled_subtract", n, gate_library), _reset(1)))
+
+
+@lru_cache(maxsize=None)
+def _multiply_mod(n, m, gate_library):
+    # bit 0 of B takes A mod N, every other bit doubles the previous term
+    add_term = _sequence(_leaf("controlled_add", n, gate_library), _reset(n), _copy(n))
+    first_bit = _sequence(_reset(n), _mod_N(n, gate_library), add_term)
+    other_bit = _sequence(_reset(n), _reset(n), _times_two_mod(n, gate_library), add_term)
+    return _borrowing(3*n, _sequence(first_bit, _repeat(m-1, other_bit), _reset(3*n)))
+
+
+@lru_cache(maxsize=None)
+def _multiply_mod_montgomery(n, m, gate_library):
+    # every bit of B adds A, then N if the sum is odd, on n+2 bits; one comparison at the end
+    bit = _sequence(_reset(n+2), _leaf("controlled_add", n+2, gate_library), _gates(cx=1), _reset(n+2), _leaf("controlled_add", n+2, gate_library), _reset(1))
+    reduce = _sequence(_leaf("greater_than_or_equal", n+2, gate_library), _reset(n), _leaf("controlled_subtract", n, gate_library))
+    return _borrowing(2*(n+2) + 4, _sequence(_repeat(m, bit), reduce, _reset(2*(n+2) + 4)))
+
+
+def _multiply_mod_fixed(n, X, gate_library, reduction="doubling"):
+    multiplication = _multiply_mod_montgomery(n, n, gate_library) if reduction == "montgomery" else _multiply_mod(n, n, gate_library)
+    return _borrowing(2*n, _sequence(_set_bits(X), multiplication, _reset(n), _copy(n), _reset(2*n)))
+
+
+def _multiply_mod_fixed_power_2_k(n, N, W, gate_library, reduction="doubling"):
+    return _borrowing(n, _sequence(_set_bits(N), _multiply_mod_fixed(n, W, gate_library, reduction), _reset(n)))
+
+
+def estimate_power_Y(N, X, Y, measure=True, window=1, reduction="doubling", gate_library="standard"):
+    # Resources of build_power_Y_core(N, X, Y, window=window, reduction=reduction, gate_library=gate_library) (N, X, Y as for multiply_mod_fixed_power_Y),
+    # without the measurements if measure is False
+    # returns {"qubits", "ancillas", "gates": {name: count}, "toffoli", "mcx", "resets", "depth_bound"}
+    check_gate_library(gate_library)
+    n = register_width(N)
+    N_value, X_value, Y_value = to_int(N), to_int(X), to_int(Y)
+
+    # every window of Y that is not 0 costs the same but for the X gates that load W = X^(j*2^k) mod N
+    if window is None:
+        window = max(Y_value.bit_length(), 1)
+    exponents = [(Y_value >> k) % 2**window * 2**k for k in range(0, Y_value.bit_length(), window) if (Y_value >> k) % 2**window]
+
+    if reduction == "montgomery" and exponents and N_value % 2 == 0:
+        # the same check as multiply_mod_fixed_power, which cannot build this circuit
+        raise ValueError("the montgomery reduction needs an odd N")
+
+    multiplications = len(exponents)
+    W_bits = 0
+    W_loads = 0
+    if N_value != 0: # W = 0 otherwise, nothing is loaded
+        # X^(2^k) mod N is squared from one window to the next, so the table entries cost O(len(Y)) products
+        # instead of a pow(X, j*2^k, N) each
+        power = X_value % N_value
+        montgomery = 2**n % N_value
+        for k in range(0, Y_value.bit_length(), window):
+            j = (Y_value >> k) % 2**window
+            if j:
+                W = pow(power, j, N_value)
+                if reduction == "montgomery":
+                    W = W * montgomery % N_value
+                W_bits += bin(W).count("1")
+                W_loads += W != 0
+            for _ in range(window):
+                power = power * power % N_value
+
+    calls = [_repeat(multiplications, _multiply_mod_fixed_power_2_k(n, N_value, 0, gate_library, reduction)), _gates(depth=W_loads, x=W_bits)]
+    if measure:
+        calls.append(_gates(measure=n))
+
+    counts, depth, peak = _sequence(*calls)
+    counts = +counts
+
+    return {
+        "qubits": n + peak,
+        "ancillas": peak,
+        "gates": dict(counts),
+        "toffoli": counts["ccx"],
+        "mcx": counts["mcx"],
+        "resets": counts["reset"],
+        "depth_bound": depth,
+    }
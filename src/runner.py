@@ -0,0 +1,184 @@
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from gates import GATE_LIBRARIES
+from cache import CircuitCache, power_Y_key, build_power_Y_core, transpile_for, load_B
+from basis_state import BasisStateSimulator
+from backends import select_backend, METHODS
+from batch import decode_counts
+from registers import check_width, register_width
+
+# Runs b * x^y mod n for a stream of jobs, one JSON object per line, from a file or stdin:
+#   {"b": "10", "n": "11", "x": "10", "y": "01"}
+#   {"id": "big", "b": "0101", "n": "1011", "x": "0111", "y": "101", "shots": 16, "adder": "cuccaro", "method": "statevector"}
+# and writes one JSON line per job as soon as it is done (not in input order, see "index"):
+#   python runner.py jobs.jsonl --workers 4 > results.jsonl
+# b, n, x, y are binary strings or ints (see registers.py); the other keys default to the command line options.
+# At most 2 * workers jobs are read ahead, so the input can be longer than what fits in memory.
+# Every worker keeps its own CircuitCache, so jobs with the same n, x, y and mode share one build.
+
+MODE_KEYS = ["reset_free", "adder", "constant", "window", "reduction", "optimize", "gate_library"]
+JOB_KEYS = ["id", "b", "n", "x", "y", "shots", "method"] + MODE_KEYS
+
+_cache = None # CircuitCache of this process, see run_job
+
+
+def parse_job(line, index, defaults):
+    # job dict from one input line, with the missing keys taken from defaults; None for a blank line
+    if not line.strip():
+        return None
+    job = json.loads(line)
+    if not isinstance(job, dict):
+        raise ValueError(f"line {index + 1}: a job must be a JSON object")
+
+    unknown = set(job) - set(JOB_KEYS)
+    if unknown:
+        raise ValueError(f"line {index + 1}: unknown keys {sorted(unknown)}, expected some of {JOB_KEYS}")
+    for key in ["b", "n", "x", "y"]:
+        value = job.get(key)
+        if isinstance(value, bool) or not (isinstance(value, int) and value >= 0 or isinstance(value, str) and value and not set(value) - set("01")):
+            raise ValueError(f"line {index + 1}: {key} must be a non-empty binary string or an int >= 0")
+    try:
+        check_width(job["b"], register_width(job["n"]), name="b")
+    except ValueError as error:
+        raise ValueError(f"line {index + 1}: {error}")
+
+    return {"index": index, **defaults, **job}
+
+
+def _positive_int(text):
+    # argparse type for --workers
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return value
+
+
+def _backend(method, circuit):
+    if method == "auto":
+        return select_backend(circuit, report=False)
+    if method == "basis_state":
+        return BasisStateSimulator()
+    from qiskit_aer import AerSimulator
+    return AerSimulator(method=method)
+
+
+def run_job(job):
+    # Result dict of one job from parse_job; an error in the job is returned in "error" instead of raised
+    global _cache
+    if "error" in job: # the line could not be parsed, see _read_jobs
+        return {"index": job["index"], "error": job["error"]}
+    if _cache is None:
+        _cache = CircuitCache()
+
+    row = {key: job[key] for key in ["index", "id", "b", "n", "x", "y"] if key in job}
+    mode = {key: job[key] for key in MODE_KEYS if key in job}
+    start = time.perf_counter()
+    try:
+        b, n, x, y = job["b"], job["n"], job["x"], job["y"]
+
+        key = power_Y_key(n, x, y, **mode)
+        build_start = time.perf_counter()
+        core = _cache.get_or_build(key, lambda: build_power_Y_core(n, x, y, **mode))
+        build_s = time.perf_counter() - build_start
+
+        backend = _backend(job.get("method", "auto"), core)
+        transpile_start = time.perf_counter()
+        transpiled_core = _cache.get_or_build(power_Y_key(n, x, y, backend=backend, **mode), lambda: transpile_for(core, backend))
+        transpile_s = time.perf_counter() - transpile_start
+
+        run_start = time.perf_counter()
+        counts = backend.run(load_B(transpiled_core, b), shots=job.get("shots", 1)).result().get_counts(0)
+        run_s = time.perf_counter() - run_start
+
+        row.update({
+            "result": decode_counts(counts),
+            "counts": counts,
+            "backend": backend.name,
+            "build_s": build_s,
+            "transpile_s": transpile_s,
+            "run_s": run_s,
+            "qubits": core.num_qubits,
+            "gates": dict(core.count_ops()),
+            "depth": core.depth(),
+        })
+    except Exception as error:
+        row["error"] = f"{type(error).__name__}: {error}"
+    row["total_s"] = time.perf_counter() - start
+    return row
+
+
+def _read_jobs(file, defaults):
+    # the jobs of the lines of file; a line that is not a valid job becomes a job with an "error"
+    for index, line in enumerate(file):
+        try:
+            job = parse_job(line, index, defaults)
+        except ValueError as error: # json.JSONDecodeError is a ValueError
+            job = {"index": index, "error": f"{type(error).__name__}: {error}"}
+        if job is not None:
+            yield job
+
+
+def run_jobs(jobs, workers=1):
+    # Yields the result of every job of the iterable jobs as it completes, see run_job
+    # workers=1 runs them in this process, in order; otherwise in a pool of workers processes
+    if workers == 1:
+        for job in jobs:
+            yield run_job(job)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for job in jobs:
+            pending.add(executor.submit(run_job, job))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Run b * x^y mod n for every job of a JSON lines file")
+    parser.add_argument("input", nargs="?", default="-", help="JSON lines file with one job per line, - for stdin")
+    parser.add_argument("--output", default="-", help="JSON lines file for the results, - for stdout")
+    parser.add_argument("--workers", type=_positive_int, default=1)
+    parser.add_argument("--shots", type=int, default=1)
+    parser.add_argument("--method", default="auto", choices=["auto"] + METHODS, help="simulation method, auto picks one per circuit with select_backend")
+    parser.add_argument("--adder", default="ripple")
+    parser.add_argument("--reduction", default="doubling")
+    parser.add_argument("--window", type=int, default=1)
+    parser.add_argument("--reset-free", action="store_true", help="unitary circuits, with about 2n^2 ancillas and several times the gates")
+    parser.add_argument("--constant", action="store_true")
+    parser.add_argument("--optimize", action="store_true")
+    parser.add_argument("--gate-library", default="standard", choices=GATE_LIBRARIES)
+    options = parser.parse_args(arguments)
+
+    defaults = {"shots": options.shots, "method": options.method, "gate_library": options.gate_library, "adder": options.adder,
+                "reduction": options.reduction, "window": options.window, "reset_free": options.reset_free,
+                "constant": options.constant, "optimize": options.optimize}
+
+    input_file = sys.stdin if options.input == "-" else open(options.input)
+    output_file = sys.stdout if options.output == "-" else open(options.output, "w")
+    errors = 0
+    try:
+        for row in run_jobs(_read_jobs(input_file, defaults), workers=options.workers):
+            errors += "error" in row
+            output_file.write(json.dumps(row) + "\n")
+            output_file.flush()
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
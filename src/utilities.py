@@ -1,3 +1,7 @@
+from math import pi
+from qiskit.circuit import ParameterVector, QuantumRegister
+
+
 def reset_bits(circuit, bits):
     for i in bits:
         circuit.reset(i)
@@ -9,6 +13,30 @@ def set_bits(circuit, A, X):
             circuit.x(A[i])
 
 
+def set_bits_parameterized(circuit, A, name="b"):
+    # like set_bits, but the value is chosen when the circuit is run: A[i] is |1> if the i-th parameter is pi, |0> if it is 0
+    # returns the parameters, see parameter_values
+    parameters = ParameterVector(name, len(A))
+    for i in range(len(A)):
+        circuit.rx(parameters[i], A[i])
+    return parameters
+
+
+def parameter_values(X):
+    # values for the parameters of set_bits_parameterized, X is in the same order set_bits takes (a string or bits)
+    return [pi if int(x) else 0 for x in X]
+
+
+def controlled_set_bits(circuit, controls, A, X):
+    # like set_bits, but only if all the controls are 1
+    for i in range(len(X)):
+        if X[i] == '1':
+            if controls:
+                circuit.mcx(list(controls), A[i])
+            else:
+                circuit.x(A[i])
+
+
 def copy(circuit, A, B):
     for i in range(len(A)):
         circuit.cx(A[i], B[i])
@@ -21,3 +49,99 @@ def controlled_copy(circuit, control, A, B):
 
 def invert_string(X):
     return "".join([str(int(x)^1) for x in X])
+
+
+def compute_uncompute(circuit, compute, copy_out):
+    # compute(block) must not use reset: its inverse is appended after copy_out(circuit),
+    # so every qubit written by compute is returned to its initial state.
+    block = circuit.copy_empty_like()
+    compute(block)
+
+    circuit.compose(block, inplace=True)
+    copy_out(circuit)
+    circuit.compose(block.inverse(), inplace=True)
+
+
+def qft(circuit, A):
+    # QFT without the final swaps: A[j] ends up with phase 2*pi*a/2^(j+1)
+    for j in reversed(range(len(A))):
+        circuit.h(A[j])
+        for i in reversed(range(j)):
+            circuit.cp(pi / 2**(j-i), A[i], A[j])
+
+
+def inverse_qft(circuit, A):
+    for j in range(len(A)):
+        for i in range(j):
+            circuit.cp(-pi / 2**(j-i), A[i], A[j])
+        circuit.h(A[j])
+
+
+class AncillaAllocator:
+    # Hands out clean ancillas to the functions that accept it in place of AUX:
+    # borrow(k) returns k qubits in |0>, release(qubits) takes them back, they must be |0> again.
+    # Released qubits are handed out again first; when none are free, new ones are added to the circuit,
+    # unless the allocator was given a fixed list of qubits. peak is the most qubits borrowed at once.
+
+    def __init__(self, circuit, qubits=None):
+        self.circuit = circuit
+        self.fixed = qubits is not None
+        self.free = list(qubits) if qubits is not None else []
+        self.live = 0
+        self.peak = 0
+
+    def borrow(self, k):
+        if len(self.free) < k:
+            if self.fixed:
+                raise ValueError(f"needs {self.live + k} ancillas, only {self.live + len(self.free)} were given")
+            register = QuantumRegister(k - len(self.free)) # not an AncillaRegister, QPY cannot load those back once transpiled
+            self.circuit.add_register(register)
+            self.free.extend(register)
+
+        borrowed = self.free[:k]
+        self.free = self.free[k:]
+        self.live += k
+        self.peak = max(self.peak, self.live)
+        return borrowed
+
+    def release(self, qubits):
+        self.free = list(qubits) + self.free
+        self.live -= len(qubits)
+
+
+def with_ancillas(circuit, allocator, k, call, reset=True):
+    # call(AUX) with k ancillas borrowed from allocator, reset (unless told otherwise) and released afterwards
+    AUX = allocator.borrow(k)
+    call(AUX)
+    if reset:
+        reset_bits(circuit=circuit, bits=AUX)
+    allocator.release(AUX)
+
+
+def take_registers(circuit, AUX, *sizes, reset=True):
+    # (registers, rest): registers of the given sizes for the body of a function in reset mode,
+    # and the AUX that is left for the functions it calls.
+    # With an AncillaAllocator they are borrowed and the rest is the allocator itself; otherwise they
+    # are the first qubits of AUX, which is reset first (unless told otherwise). See release_registers
+    if isinstance(AUX, AncillaAllocator):
+        return [AUX.borrow(size) for size in sizes], AUX
+
+    if reset:
+        reset_bits(circuit=circuit, bits=AUX)
+    registers = []
+    start = 0
+    for size in sizes:
+        registers.append(AUX[start:start+size])
+        start += size
+    return registers, AUX[start:]
+
+
+def release_registers(circuit, AUX, registers):
+    # end of a body that used take_registers: the registers are reset and given back to the allocator,
+    # a plain AUX is reset as a whole
+    if isinstance(AUX, AncillaAllocator):
+        qubits = [qubit for register in registers for qubit in register]
+        reset_bits(circuit=circuit, bits=qubits)
+        AUX.release(qubits)
+    else:
+        reset_bits(circuit=circuit, bits=AUX)
@@ -3,10 +3,19 @@ from qiskit import QuantumCircuit, transpile
 from qiskit_aer import AerSimulator
 import sys
 import os
+import tempfile
+import subprocess
+import contextlib
+import io
+import json
+import time
+from collections import Counter
+import numpy as np
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
 
-from main import *
+from api import *
+import reference
 
 backend = AerSimulator()
 
@@ -434,6 +443,929 @@ class Test(unittest.TestCase):
             self.assertEqual(counts, expected_counts)
 
 
+    def test_add_mod_reset_free(self):
+        # the sum does not wrap at 2 bits ('10' + '10' mod '11'), and all the ancillas are |0> again
+        tests = [
+            [('00', '00', '00'), '00'],
+            [('00', '11', '10'), '01'],
+            [('01', '01', '11'), '10'],
+            [('00', '01', '01'), '00'],
+            [('10', '10', '11'), '01'],
+        ]
+
+        for adder in ["ripple", "cuccaro"]:
+            for (a, b, n), expected in tests:
+                circuit = QuantumCircuit(8+2*len(a)+6)
+                set_bits(circuit, A=[0,1], X="".join(reversed(a)))
+                set_bits(circuit, A=[2,3], X="".join(reversed(b)))
+                set_bits(circuit, A=[4,5], X="".join(reversed(n)))
+
+                add_mod(circuit=circuit, A=[0,1], B=[2,3], N=[4,5], R=[6,7], AUX=range(8,8+2*len(a)+6), reset_free=True, adder=adder)
+                self.assertNotIn('reset', circuit.count_ops())
+
+                state, _ = simulate(circuit)
+                self.assertEqual(register_values(state, [6,7])[0], int(expected, 2))
+                self.assertEqual(register_values(state, range(8,8+2*len(a)+6))[0], 0)
+
+    def test_multiply_mod_reset_free(self):
+        # A * B mod N for every N of 3 bits, A < N and B: exact, and all the ancillas are |0> again
+        n = 3
+        aux_size = (2*n+3)*n+6
+        A, B, N, R = range(0, n), range(n, 2*n), range(2*n, 3*n), range(3*n, 4*n)
+        AUX = range(4*n, 4*n+aux_size)
+
+        for adder in ["ripple", "cuccaro"]:
+            for n_value in range(1, 2**n):
+                circuit = QuantumCircuit(4*n+aux_size)
+                multiply_mod(circuit=circuit, A=A, B=B, N=N, R=R, AUX=AUX, reset_free=True, adder=adder)
+                self.assertNotIn('reset', circuit.count_ops())
+
+                a_values, b_values = [array.ravel() for array in np.meshgrid(np.arange(n_value), np.arange(2**n))]
+                inputs = a_values | b_values << n | n_value << 2*n
+                state, _ = simulate(circuit, initial_state=register_state(inputs, circuit.num_qubits))
+
+                self.assertEqual(list(register_values(state, R)), list(a_values * b_values % n_value))
+                self.assertEqual(list(register_values(state, range(3*n))), list(inputs))
+                self.assertFalse(register_values(state, AUX).any())
+
+    def test_multiply_mod_fixed_power_Y_reset_free(self):
+        # B must be < N, the ancillas are |0> again at the end
+        tests = [
+            [('01', '01', '11', '11'), '01'],
+            [('10', '01', '11', '11'), '10'],
+            [('01', '01', '00', '11'), '01'],
+            [('01', '11', '11', '10'), '01'],
+            [('001', '011', '01', '101'), '011'],
+            [('011', '010', '11', '101'), '100'],
+        ]
+
+        for adder in ["ripple", "cuccaro"]:
+            for (b, x, y, n), expected in tests:
+                aux_size = multiply_mod_fixed_power_Y_aux_size(len(b), reset_free=True, adder=adder)
+                AUX = range(len(b), len(b)+aux_size)
+                circuit = QuantumCircuit(len(b)+aux_size)
+                set_bits(circuit, A=range(len(b)), X="".join(reversed(b)))
+
+                multiply_mod_fixed_power_Y(circuit=circuit, N=n, X=x, Y=y, B=range(len(b)), AUX=AUX, reset_free=True, adder=adder)
+                self.assertNotIn('reset', circuit.count_ops())
+
+                state, _ = simulate(circuit)
+                self.assertEqual(register_values(state, range(len(b)))[0], int(expected, 2))
+                self.assertEqual(register_values(state, AUX)[0], 0)
+
+    def test_multiply_mod_fixed_power_2_k_reset_free_not_invertible(self):
+        circuit = QuantumCircuit(22, 2)
+
+        with self.assertRaises(ValueError):
+            multiply_mod_fixed_power_2_k(circuit=circuit, N='10', X='10', B=[0,1], k=0, AUX=range(2, 22), reset_free=True)
+
+    def test_add_in_place(self):
+        tests = [
+            [('00', '00'), {'00': 1024}],
+            [('00', '01'), {'01': 1024}],
+            [('01', '01'), {'10': 1024}],
+            [('10', '01'), {'11': 1024}],
+            [('11', '01'), {'00': 1024}],
+            [('11', '11'), {'10': 1024}],
+        ]
+
+        for (a, b), expected_counts in tests:
+            circuit = QuantumCircuit(5, 2)
+            set_bits(circuit, A=[0,1], X="".join(reversed(a)))
+            set_bits(circuit, A=[2,3], X="".join(reversed(b)))
+
+            add_in_place(circuit, A=[0,1], B=[2,3], AUX=[4])
+            circuit.measure([2,3], [0,1])
+
+            transpiled_circuit = transpile(circuit, backend)
+            n_shots = 1024
+            job_sim = backend.run(transpiled_circuit, shots=n_shots)
+            result_sim = job_sim.result()
+            counts = result_sim.get_counts(transpiled_circuit)
+
+            self.assertEqual(counts, expected_counts)
+
+    def test_subtract_cuccaro(self):
+        tests = [
+            [('00', '00'), {'00': 1024}],
+            [('10', '01'), {'01': 1024}],
+            [('11', '01'), {'10': 1024}],
+            [('01', '10'), {'11': 1024}],
+            [('11', '11'), {'00': 1024}],
+        ]
+
+        for (a, b), expected_counts in tests:
+            circuit = QuantumCircuit(7, 2)
+            set_bits(circuit, A=[0,1], X="".join(reversed(a)))
+            set_bits(circuit, A=[2,3], X="".join(reversed(b)))
+
+            subtract(circuit, A=[0,1], B=[2,3], R=[4,5], AUX=[6], adder="cuccaro")
+            circuit.measure([4,5], [0,1])
+
+            transpiled_circuit = transpile(circuit, backend)
+            n_shots = 1024
+            job_sim = backend.run(transpiled_circuit, shots=n_shots)
+            result_sim = job_sim.result()
+            counts = result_sim.get_counts(transpiled_circuit)
+
+            self.assertEqual(counts, expected_counts)
+
+    def test_controlled_add_cuccaro(self):
+        tests = [
+            [('01', '01', '0'), {'01': 1024}],
+            [('01', '01', '1'), {'10': 1024}],
+            [('11', '10', '0'), {'11': 1024}],
+            [('11', '10', '1'), {'01': 1024}],
+        ]
+
+        for (a, b, c), expected_counts in tests:
+            circuit = QuantumCircuit(8, 2)
+            set_bits(circuit, A=[0,1], X="".join(reversed(a)))
+            set_bits(circuit, A=[2,3], X="".join(reversed(b)))
+            set_bits(circuit, A=[4], X=c)
+
+            controlled_add(circuit, control=4, A=[0,1], B=[2,3], R=[5,6], AUX=[7], adder="cuccaro")
+            circuit.measure([5,6], [0,1])
+
+            transpiled_circuit = transpile(circuit, backend)
+            n_shots = 1024
+            job_sim = backend.run(transpiled_circuit, shots=n_shots)
+            result_sim = job_sim.result()
+            counts = result_sim.get_counts(transpiled_circuit)
+
+            self.assertEqual(counts, expected_counts)
+
+    def test_multiply_mod_fixed_power_Y_cuccaro(self):
+        n_shots = 1
+        
+        tests = [
+            [('00', '00', '00', '00'), {'00': n_shots}],
+            [('00', '01', '00', '01'), {'00': n_shots}],
+            [('01', '10', '01', '01'), {'00': n_shots}],
+            [('10', '10', '00', '11'), {'10': n_shots}],
+            [('10', '01', '11', '11'), {'10': n_shots}],
+        ]
+
+        for (b, x, y, n), expected_counts in tests:
+            circuit = QuantumCircuit(14, 2)
+            set_bits(circuit, A=[0,1], X="".join(reversed(b)))
+
+            multiply_mod_fixed_power_Y(circuit=circuit, N=n, X=x, Y=y, B=[0,1], AUX=range(2, 2+(5*len(b)+2)), adder="cuccaro")
+            circuit.measure([0,1], [0,1])
+
+            transpiled_circuit = transpile(circuit, backend)
+            job_sim = backend.run(transpiled_circuit, shots=n_shots)
+            result_sim = job_sim.result()
+            counts = result_sim.get_counts(transpiled_circuit)
+
+            self.assertEqual(counts, expected_counts)
+
+    def test_add_draper(self):
+        tests = [
+            [('00', '00'), {'00': 1024}],
+            [('00', '01'), {'01': 1024}],
+            [('01', '01'), {'10': 1024}],
+            [('10', '01'), {'11': 1024}],
+            [('11', '01'), {'00': 1024}],
+            [('11', '11'), {'10': 1024}],
+        ]
+
+        for (a, b), expected_counts in tests:
+            circuit = QuantumCircuit(6, 2)
+            set_bits(circuit, A=[0,1], X="".join(reversed(a)))
+            set_bits(circuit, A=[2,3], X="".join(reversed(b)))
+
+            add(circuit, A=[0,1], B=[2,3], R=[4,5], AUX=[], adder="draper")
+            circuit.measure([4,5], [0,1])
+
+            transpiled_circuit = transpile(circuit, backend)
+            n_shots = 1024
+            job_sim = backend.run(transpiled_circuit, shots=n_shots)
+            result_sim = job_sim.result()
+            counts = result_sim.get_counts(transpiled_circuit)
+
+            self.assertEqual(counts, expected_counts)
+
+    def test_add_mod_draper(self):
+        n_shots = 1
+
+        tests = [
+            [('00', '00', '00'), {'00': n_shots}],
+            [('00', '11', '10'), {'01': n_shots}],
+            [('01', '01', '11'), {'10': n_shots}],
+            [('00', '01', '01'), {'00': n_shots}],
+        ]
+
+        for (a, b, n), expected_counts in tests:
+            circuit = QuantumCircuit(12, 2)
+            set_bits(circuit, A=[0,1], X="".join(reversed(a)))
+            set_bits(circuit, A=[2,3], X="".join(reversed(b)))
+            set_bits(circuit, A=[4,5], X="".join(reversed(n)))
+
+            add_mod(circuit=circuit, A=[0,1], B=[2,3], N=[4,5], R=[6,7], AUX=range(8,8+len(a)+2), adder="draper")
+            circuit.measure([6,7], [0,1])
+
+            transpiled_circuit = transpile(circuit, backend)
+            job_sim = backend.run(transpiled_circuit, shots=n_shots)
+            result_sim = job_sim.result()
+            counts = result_sim.get_counts(transpiled_circuit)
+
+            self.assertEqual(counts, expected_counts)
+
+    def test_phase_add_mod_constant(self):
+        n_shots = 1024
+
+        tests = [
+            [('00', 0, 3, '1'), {'000': n_shots}],
+            [('01', 1, 3, '1'), {'010': n_shots}],
+            [('10', 2, 3, '1'), {'001': n_shots}],
+            [('10', 2, 3, '0'), {'010': n_shots}],
+            [('10', 1, 3, '1'), {'000': n_shots}],
+        ]
+
+        for (b, a, n, c), expected_counts in tests:
+            circuit = QuantumCircuit(5, 3)
+            set_bits(circuit, A=[0,1], X="".join(reversed(b)))
+            set_bits(circuit, A=[4], X=c)
+
+            qft(circuit, [0,1,2])
+            phase_add_mod_constant(circuit=circuit, N=n, a=a, B=[0,1,2], AUX=[3], controls=[4])
+            inverse_qft(circuit, [0,1,2])
+            circuit.measure([0,1,3], [0,1,2])
+
+            transpiled_circuit = transpile(circuit, backend)
+            job_sim = backend.run(transpiled_circuit, shots=n_shots)
+            result_sim = job_sim.result()
+            counts = result_sim.get_counts(transpiled_circuit)
+
+            self.assertEqual(counts, expected_counts)
+
+
+    def test_multiply_mod_fixed_power_Y_constant(self):
+        n_shots = 1
+
+        tests = [
+            [('00', '10', '11', '11'), {'00': n_shots}],
+            [('01', '10', '11', '11'), {'10': n_shots}],
+            [('10', '10', '11', '11'), {'01': n_shots}],
+            [('10', '10', '00', '11'), {'10': n_shots}],
+            [('01', '11', '00', '11'), {'01': n_shots}],
+            [('01', '11', '11', '11'), {'00': n_shots}],
+            [('10', '01', '11', '11'), {'10': n_shots}],
+        ]
+
+        for adder, n_aux in [("draper", 4), ("cuccaro", 8)]:
+            for (b, x, y, n), expected_counts in tests:
+                circuit = QuantumCircuit(2+n_aux, 2)
+                set_bits(circuit, A=[0,1], X="".join(reversed(b)))
+
+                multiply_mod_fixed_power_Y(circuit=circuit, N=n, X=x, Y=y, B=[0,1], AUX=range(2, 2+n_aux), adder=adder, constant=True)
+                circuit.measure([0,1], [0,1])
+
+                transpiled_circuit = transpile(circuit, backend)
+                job_sim = backend.run(transpiled_circuit, shots=n_shots)
+                result_sim = job_sim.result()
+                counts = result_sim.get_counts(transpiled_circuit)
+
+                self.assertEqual(counts, expected_counts)
+
+    def test_multiply_mod_fixed_constant_reset_free(self):
+        n_shots = 1024
+
+        tests = [
+            [('00', '10', '11'), {'000000': n_shots}],
+            [('01', '10', '11'), {'000010': n_shots}],
+            [('10', '10', '11'), {'000001': n_shots}],
+            [('10', '11', '11'), {'000000': n_shots}],
+        ]
+
+        for (b, x, n), expected_counts in tests:
+            circuit = QuantumCircuit(6, 6)
+            set_bits(circuit, A=[0,1], X="".join(reversed(b)))
+
+            if x == '11':
+                with self.assertRaises(ValueError):
+                    multiply_mod_fixed_constant(circuit=circuit, N=n, X=x, B=[0,1], AUX=[2,3,4,5], reset_free=True)
+                continue
+
+            multiply_mod_fixed_constant(circuit=circuit, N=n, X=x, B=[0,1], AUX=[2,3,4,5], reset_free=True)
+            circuit.measure(range(6), range(6))
+
+            transpiled_circuit = transpile(circuit, backend)
+            job_sim = backend.run(transpiled_circuit, shots=n_shots)
+            result_sim = job_sim.result()
+            counts = result_sim.get_counts(transpiled_circuit)
+
+            self.assertEqual(counts, expected_counts)
+
+    def test_multiply_mod_cuccaro(self):
+        n_shots = 1
+
+        tests = [
+            [("01", "011", "11"), {'11': n_shots}],
+            [("10", "110", "11"), {'00': n_shots}],
+            [("01", "100", "10"), {'00': n_shots}],
+            [("11", "111", "10"), {'01': n_shots}],
+            [("00", "101", "11"), {'00': n_shots}],
+        ]
+
+        for (a, b, n), expected_counts in tests:
+            circuit = QuantumCircuit(15, 2)
+            set_bits(circuit, A=[0,1], X="".join(reversed(a)))
+            set_bits(circuit, A=[2,3,4], X="".join(reversed(b)))
+            set_bits(circuit, A=[5,6], X="".join(reversed(n)))
+
+            multiply_mod(circuit=circuit, A=[0,1], B=[2,3,4], N=[5,6], R=[7,8], AUX=range(9,9+2*len(a)+2), adder="cuccaro")
+            circuit.measure([7,8], [0,1])
+
+            transpiled_circuit = transpile(circuit, backend)
+            job_sim = backend.run(transpiled_circuit, shots=n_shots)
+            result_sim = job_sim.result()
+            counts = result_sim.get_counts(transpiled_circuit)
+
+            self.assertEqual(counts, expected_counts)
+
+    def test_circuit_cache(self):
+        n_shots = 1
+
+        tests = [
+            [('01', '10', '11', '11'), {'10': n_shots}],
+            [('10', '10', '11', '11'), {'01': n_shots}],
+            [('10', '01', '11', '11'), {'10': n_shots}],
+        ]
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = CircuitCache(max_entries=2, directory=directory)
+
+            for (b, x, y, n), expected_counts in tests:
+                transpiled_circuit = cached_power_Y_circuit(cache, b=b, N=n, X=x, Y=y, backend=backend, adder="draper", constant=True)
+                job_sim = backend.run(transpiled_circuit, shots=n_shots)
+                result_sim = job_sim.result()
+                counts = result_sim.get_counts(transpiled_circuit)
+
+                self.assertEqual(counts, expected_counts)
+
+            # the second b for X=10 reused both the built and the transpiled circuit
+            self.assertEqual(cache.hits, 2)
+            self.assertEqual(len(cache.entries), 2)
+
+            # the evicted entries are still on disk
+            disk_cache = CircuitCache(directory=directory)
+            self.assertIsNotNone(disk_cache.get(power_Y_key('11', '10', '11', adder="draper", constant=True, backend=backend)))
+            self.assertIsNone(disk_cache.get(power_Y_key('11', '10', '10', adder="draper", constant=True, backend=backend)))
+
+            # but not once the builders or qiskit have changed
+            import cache as cache_module
+            self.addCleanup(setattr, cache_module, "BUILDER_VERSION", cache_module.BUILDER_VERSION)
+            cache_module.BUILDER_VERSION = "another version"
+            self.assertIsNone(CircuitCache(directory=directory).get(power_Y_key('11', '10', '11', adder="draper", constant=True, backend=backend)))
+
+    def test_power_Y_sweep(self):
+        cache = CircuitCache()
+
+        tests = [
+            [('10', '11', '11'), {'00': {'00': 1}, '01': {'10': 1}, '10': {'01': 1}}],
+            [('01', '11', '11'), {'00': {'00': 1}, '01': {'01': 1}, '10': {'10': 1}}],
+        ]
+
+        for (x, y, n), expected_counts in tests:
+            counts = power_Y_sweep(['00', '01', '10'], N=n, X=x, Y=y, backend=backend, cache=cache, adder="draper", constant=True)
+
+            self.assertEqual(counts, expected_counts)
+
+        # one build and one transpile for each X
+        self.assertEqual(cache.misses, 4)
+
+    def test_run_batch(self):
+        inputs = [
+            ('01', '11', '10', '11'),
+            ('10', '11', '10', '11'),
+            ('10', '11', '01', '11'),
+            ('011', '101', '011', '11'),
+            ('100', '111', '010', '101'),
+        ]
+        expected_results = {
+            ('01', '11', '10', '11'): 2,
+            ('10', '11', '10', '11'): 1,
+            ('10', '11', '01', '11'): 2,
+            ('011', '101', '011', '11'): 1,
+            ('100', '111', '010', '101'): 2,
+        }
+
+        cache = CircuitCache()
+        results = run_batch(inputs, backend=backend, cache=cache, adder="draper", constant=True)
+
+        self.assertEqual(results, expected_results)
+        self.assertEqual(len(cache.entries), 4)
+
+    def test_run_batch_parallel(self):
+        inputs = [
+            ('01', '11', '10', '11'),
+            ('10', '11', '01', '11'),
+            ('011', '101', '011', '11'),
+        ]
+        expected_results = {
+            ('01', '11', '10', '11'): 2,
+            ('10', '11', '01', '11'): 2,
+            ('011', '101', '011', '11'): 1,
+        }
+
+        results = run_batch(inputs, backend=backend, adder="draper", constant=True, workers=2)
+
+        self.assertEqual(results, expected_results)
+
+    def test_reference(self):
+        # same cases as test_add, test_subtract and test_multiply_mod
+        self.assertEqual(list(reference.add([0, 1, 3, 3], [1, 1, 1, 3], 2)), [1, 2, 0, 2])
+        self.assertEqual(list(reference.subtract([2, 1, 3, 3], [1, 1, 1, 3], 2)), [1, 0, 2, 0])
+        self.assertEqual(list(reference.multiply_mod([0, 3, 1, 2], [0, 1, 1, 1], [0, 2, 1, 2], 2)), [0, 2, 0, 0])
+
+        # 3 * 2^5 mod 7 is 5, but the partial products of multiply_mod overflow 3 bits
+        self.assertEqual(reference.multiply_mod_fixed_power_Y(7, 2, 3, 5, 3), 4)
+        self.assertEqual(list(reference.multiply_mod_fixed_power_Y(3, 2, [0, 1, 2], [1, 2, 3], 2)), [0, 1, 0])
+
+        # the products are exact beyond 64 bits
+        N, X, B = 2**32 - 5, 2**32 - 7, 2**32 - 9
+        self.assertEqual(reference.multiply_mod_fixed_power_Y(N, X, B, 3, 32, reset_free=True), B * pow(X, 3, N) % N)
+        self.assertEqual(reference.multiply_mod_fixed_power_Y(N, X, B, 1, 32), reference.multiply_mod(N, X, B, 32))
+        self.assertEqual(reference.add(2**64 - 1, 2, 64), 1)
+
+    def test_exhaustive_check(self):
+        self.assertEqual(reference.exhaustive_check(1, backend=backend, adder="cuccaro"), [])
+        self.assertEqual(reference.exhaustive_check(2, backend=backend, y_width=1, adder="draper", constant=True), [])
+
+    def test_basis_state_simulator(self):
+        basis_state_backend = BasisStateSimulator()
+
+        # every b of 4 bits in one pass through the circuit
+        B_values = [format(b, '04b') for b in range(16)]
+        counts = power_Y_sweep(B_values, N='1101', X='0111', Y='1011', backend=basis_state_backend, adder="cuccaro")
+        expected_results = reference.multiply_mod_fixed_power_Y(13, 7, range(16), 11, 4)
+        self.assertEqual([int(max(counts[b], key=counts[b].get), 2) for b in B_values], list(expected_results))
+
+        self.assertEqual(reference.exhaustive_check(2, backend=basis_state_backend, y_width=1), [])
+
+        circuit = QuantumCircuit(1, 1)
+        circuit.h(0)
+        with self.assertRaises(ValueError):
+            basis_state_backend.run(circuit)
+
+        # the counts of a circuit are looked up like in the results of AerSimulator
+        zero, one = QuantumCircuit(1, 1, name="zero"), QuantumCircuit(1, 1, name="one")
+        one.x(0)
+        zero.measure(0, 0)
+        one.measure(0, 0)
+        result = basis_state_backend.run([zero, one]).result()
+        self.assertEqual(result.get_counts(one), {'1': 1})
+        self.assertEqual(result.get_counts("zero"), {'0': 1})
+        self.assertEqual(result.get_counts(1), {'1': 1})
+        self.assertEqual(result.get_counts(), [{'0': 1}, {'1': 1}])
+        for experiment in [circuit, "two", 0.5]:
+            with self.assertRaises(ValueError):
+                result.get_counts(experiment)
+
+    def test_select_backend(self):
+        tests = [
+            [('1101', '0111', '1011', "ripple", False), 2**30, "basis_state"],
+            [('11', '10', '11', "draper", True), 2**30, "statevector"],
+            [('1101', '0111', '1011', "draper", False), 2**33, "matrix_product_state"],
+        ]
+
+        for (n, x, y, adder, constant), memory_limit, expected_method in tests:
+            circuit = build_power_Y_core(n, x, y, adder=adder, constant=constant)
+            method, estimates = select_method(circuit, memory_limit=memory_limit)
+
+            self.assertEqual(method, expected_method)
+            self.assertEqual(estimates["statevector"], 16 * 2**circuit.num_qubits)
+
+        with self.assertRaises(MemoryError):
+            select_method(circuit, memory_limit=1)
+
+        # 20 entangled pairs: the middle bond of the MPS is 2^20 when the pairs straddle it
+        circuit = QuantumCircuit(40)
+        for i in range(20):
+            circuit.h(i)
+            circuit.t(i)
+            circuit.cx(i, 20 + i)
+        self.assertGreaterEqual(memory_estimates(circuit)["matrix_product_state"], 16 * 2**40)
+        # the approximate method is only picked when asked for
+        with self.assertRaises(MemoryError):
+            select_method(circuit, memory_limit=2**30)
+        self.assertEqual(select_method(circuit, memory_limit=2**30, approximate=True)[0], "extended_stabilizer")
+
+    def test_ancilla_allocator(self):
+        tests = [
+            [('01', '10', '01', '11'), '10'],
+            [('10', '10', '11', '11'), '00'],
+            [('11', '11', '01', '10'), '01'],
+        ]
+
+        for (b, x, y, n), expected_result in tests:
+            circuit = QuantumCircuit(2, 2)
+            set_bits(circuit, A=[0,1], X="".join(reversed(b)))
+
+            allocator = AncillaAllocator(circuit)
+            multiply_mod_fixed_power_Y(circuit=circuit, N=n, X=x, Y=y, B=[0,1], AUX=allocator)
+            circuit.measure([0,1], [0,1])
+
+            # 8n+1+max(5, n+1) instead of 9n+6
+            self.assertEqual(allocator.peak, 22)
+            self.assertEqual(circuit.num_qubits, 2 + 22)
+            self.assertEqual(allocator.live, 0)
+
+            counts = BasisStateSimulator().run(circuit).result().get_counts()
+            self.assertEqual(counts, {expected_result: 1})
+
+        circuit = QuantumCircuit(26, 2)
+        with self.assertRaises(ValueError):
+            multiply_mod_fixed_power_Y(circuit=circuit, N='11', X='10', Y='01', B=[0,1], AUX=AncillaAllocator(circuit, qubits=range(2, 23)))
+
+    def test_estimate_power_Y(self):
+        tests = [
+            ('11', '10', '01'),
+            ('11', '01', '11'),
+            ('101', '011', '110'),
+            ('1101', '0111', '1011'),
+            ('1101', '0111', '0000'),
+        ]
+
+        for n, x, y in tests:
+            circuit = build_power_Y_core(n, x, y)
+            estimate = estimate_power_Y(n, x, y)
+
+            self.assertEqual(estimate["gates"], dict(circuit.count_ops()))
+            self.assertEqual(estimate["qubits"], circuit.num_qubits)
+            self.assertEqual(estimate["toffoli"], circuit.count_ops().get("ccx", 0))
+            self.assertGreaterEqual(estimate["depth_bound"], circuit.depth())
+
+        # nothing is built, so large widths are cheap
+        self.assertEqual(estimate_power_Y('1' * 1000, '1' * 999 + '0', '1' * 1000)["qubits"], 1000 + 9*1000 + 2)
+        # also for an X that is not -1 mod N, where every W = X^(2^k) mod N is a different 1000 bit number
+        N = '1' + '0110' * 249 + '101'
+        X = '1101' * 250
+        estimate = estimate_power_Y(N, X, '1' * 1000, window=4, reduction="montgomery")
+        W = [pow(int(X, 2), 15 * 2**k, int(N, 2)) * 2**1000 % int(N, 2) for k in range(0, 1000, 4)]
+        no_W = estimate_power_Y(N, '0' * 1000, '1' * 1000, window=4, reduction="montgomery")
+        self.assertEqual(estimate["gates"]["x"] - no_W["gates"]["x"], sum(bin(w).count("1") for w in W))
+
+        # the circuits multiply_mod_fixed_power refuses to build have no estimate either
+        for n in ['0000', '1010']:
+            with self.assertRaises(ValueError):
+                build_power_Y_core(n, '0111', '11', reduction="montgomery")
+            with self.assertRaises(ValueError):
+                estimate_power_Y(n, '0111', '11', reduction="montgomery")
+
+    def test_multiply_mod_fixed_power_Y_windowed(self):
+        # b, n, x, y, window
+        tests = [
+            ('10', '11', '10', '11', 2),
+            ('011', '101', '011', '110', 2),
+            ('011', '101', '011', '111', None),
+            ('0101', '1101', '0111', '1011', 3),
+            ('001', '111', '010', '000', 2),
+        ]
+
+        for b, n, x, y, window in tests:
+            results = run_batch([(b, n, x, y)], backend=BasisStateSimulator(), window=window)
+            expected = reference.multiply_mod_fixed_power_Y(int(n, 2), int(x, 2), int(b, 2), int(y, 2), len(n), window=window)
+            self.assertEqual(results[(b, n, x, y)], expected)
+
+            # one multiplication per window instead of one per set bit of y
+            self.assertLessEqual(estimate_power_Y(n, x, y, window=window)["gates"].get("ccx", 0), estimate_power_Y(n, x, y)["gates"].get("ccx", 0))
+            self.assertEqual(estimate_power_Y(n, x, y, window=window)["gates"], dict(build_power_Y_core(n, x, y, window=window).count_ops()))
+
+        # with the constant multiplier every window gives b * x^y mod n exactly
+        results = run_batch([('0101', '1101', '0111', '1011')], backend=BasisStateSimulator(), adder="cuccaro", constant=True, window=2)
+        self.assertEqual(results[('0101', '1101', '0111', '1011')], 5 * 7**11 % 13)
+
+    def test_multiply_mod_montgomery(self):
+        n_shots = 1
+
+        # 2^-2 = 1 mod 3, so R = A * B mod 3
+        tests = [
+            [("01", "11", "11"), {'00': n_shots}],
+            [("10", "10", "11"), {'01': n_shots}],
+            [("10", "11", "11"), {'00': n_shots}],
+            [("01", "01", "11"), {'01': n_shots}],
+            [("00", "10", "11"), {'00': n_shots}],
+        ]
+
+        for (a, b, n), expected_counts in tests:
+            circuit = QuantumCircuit(17, 2)
+            set_bits(circuit, A=[0,1], X="".join(reversed(a)))
+            set_bits(circuit, A=[2,3], X="".join(reversed(b)))
+            set_bits(circuit, A=[4,5], X="".join(reversed(n)))
+
+            multiply_mod(circuit=circuit, A=[0,1], B=[2,3], N=[4,5], R=[6,7], AUX=range(8,8+len(a)+7), adder="cuccaro", reduction="montgomery")
+            circuit.measure([6,7], [0,1])
+
+            transpiled_circuit = transpile(circuit, backend)
+            job_sim = backend.run(transpiled_circuit, shots=n_shots)
+            result_sim = job_sim.result()
+            counts = result_sim.get_counts(transpiled_circuit)
+
+            self.assertEqual(counts, expected_counts)
+
+        # W is loaded in Montgomery form, so b * x^y mod n comes out exact
+        for adder in ["ripple", "cuccaro"]:
+            inputs = [('0101', '1101', '0111', '1011'), ('1111', '1011', '0011', '0110'), ('0110', '1001', '0101', '0011')]
+            results = run_batch(inputs, backend=BasisStateSimulator(), adder=adder, reduction="montgomery")
+            for b, n, x, y in inputs:
+                self.assertEqual(results[(b, n, x, y)], int(b, 2) * int(x, 2)**int(y, 2) % int(n, 2))
+
+        self.assertEqual(reference.exhaustive_check(2, BasisStateSimulator(), reduction="montgomery"), [])
+        with self.assertRaises(ValueError):
+            build_power_Y_core('10', '01', '01', reduction="montgomery")
+
+        # one comparison per multiplication instead of one per bit
+        self.assertLess(estimate_power_Y('1' * 16, '1' * 15 + '0', '1' * 4, reduction="montgomery")["toffoli"], estimate_power_Y('1' * 16, '1' * 15 + '0', '1' * 4)["toffoli"])
+
+    def test_peephole_optimizer(self):
+        n_shots = 1
+
+        tests = [
+            [("01", "10", "0"), {'01': n_shots}],
+            [("01", "10", "1"), {'11': n_shots}],
+            [("11", "11", "1"), {'10': n_shots}],
+        ]
+
+        for (a, b, control), expected_counts in tests:
+            circuit = QuantumCircuit(12, 2)
+            set_bits(circuit, A=[0,1], X="".join(reversed(a)))
+            set_bits(circuit, A=[2,3], X="".join(reversed(b)))
+            set_bits(circuit, A=[4], X=control)
+
+            controlled_add(circuit=circuit, control=4, A=[0,1], B=[2,3], R=[5,6], AUX=range(7,12))
+            reset_bits(circuit=circuit, bits=range(7,12))
+            copy(circuit=circuit, A=[5,6], B=[0,1])
+            circuit.measure([5,6], [0,1])
+
+            optimized_circuit, report = optimize_circuit(circuit)
+
+            self.assertEqual(report["saved"], circuit.size() - optimized_circuit.size())
+            self.assertGreater(report["resets"], 0)
+            self.assertEqual(report["folded"], 1) # the x(control) around the controlled_copy
+            self.assertEqual(report["barriers"], 1)
+            self.assertNotIn("barrier", optimized_circuit.count_ops())
+
+            transpiled_circuit = transpile(optimized_circuit, backend)
+            job_sim = backend.run(transpiled_circuit, shots=n_shots)
+            result_sim = job_sim.result()
+            counts = result_sim.get_counts(transpiled_circuit)
+
+            self.assertEqual(counts, expected_counts)
+
+        # an inverse_qft followed by a qft cancels out
+        circuit = QuantumCircuit(3)
+        inverse_qft(circuit, [0,1,2])
+        qft(circuit, [0,1,2])
+        optimized_circuit, report = optimize_circuit(circuit)
+        self.assertEqual(optimized_circuit.size(), 0)
+        self.assertEqual(report["cancelled"], 6)
+
+        for adder in ["ripple", "cuccaro"]:
+            self.assertEqual(reference.exhaustive_check(2, BasisStateSimulator(), adder=adder, optimize=True), [])
+
+    def test_gate_library(self):
+        n_shots = 1
+
+        # (a, b, control), reset_free, adder
+        tests = [
+            [("01", "10", "1"), False, "ripple"],
+            [("11", "11", "1"), True, "ripple"],
+            [("11", "01", "0"), False, "ripple"],
+            [("10", "11", "1"), False, "cuccaro"],
+            [("11", "10", "0"), False, "cuccaro"],
+        ]
+
+        for (a, b, control), reset_free, adder in tests:
+            counts = {}
+            toffolis = {}
+            for gate_library in GATE_LIBRARIES:
+                circuit = QuantumCircuit(12, 2)
+                set_bits(circuit, A=[0,1], X="".join(reversed(a)))
+                set_bits(circuit, A=[2,3], X="".join(reversed(b)))
+                set_bits(circuit, A=[4], X=control)
+
+                controlled_add(circuit=circuit, control=4, A=[0,1], B=[2,3], R=[5,6], AUX=range(7,12), reset_free=reset_free, adder=adder, gate_library=gate_library)
+                circuit.measure([5,6], [0,1])
+
+                transpiled_circuit = transpile(circuit, backend)
+                job_sim = backend.run(transpiled_circuit, shots=n_shots)
+                counts[gate_library] = job_sim.result().get_counts(transpiled_circuit)
+                toffolis[gate_library] = sum(count for name, count in circuit.count_ops().items() if name.startswith(("ccx", "mcx")))
+
+            expected = int(a, 2) + int(b, 2) if control == "1" else int(a, 2)
+            self.assertEqual(counts["standard"], {format(expected % 4, '02b'): n_shots})
+            self.assertEqual(counts["low_cost"], counts["standard"])
+            self.assertLess(toffolis["low_cost"], toffolis["standard"])
+
+        self.assertEqual(reference.exhaustive_check(2, BasisStateSimulator(), gate_library="low_cost"), [])
+        for gate_library in GATE_LIBRARIES:
+            self.assertEqual(estimate_power_Y('101', '011', '110', gate_library=gate_library)["gates"],
+                             dict(build_power_Y_core('101', '011', '110', gate_library=gate_library).count_ops()))
+        # the cache tells the libraries apart
+        self.assertNotEqual(power_Y_key('101', '011', '110', gate_library="low_cost"), power_Y_key('101', '011', '110'))
+
+        with self.assertRaises(ValueError):
+            build_power_Y_core('101', '011', '110', gate_library="relative_phase")
+        with self.assertRaises(ValueError):
+            estimate_power_Y('101', '011', '110', gate_library="relative_phase")
+
+    def test_benchmark(self):
+        report = run_benchmarks([1, 2], y_widths=[2], functions=["add", "multiply_mod_fixed_power_Y"], backend=BasisStateSimulator())
+
+        self.assertEqual([(row["function"], row["n"], row["y_width"]) for row in report["results"]],
+                         [("add", 1, None), ("add", 2, None), ("multiply_mod_fixed_power_Y", 1, 2), ("multiply_mod_fixed_power_Y", 2, 2)])
+        for row in report["results"]:
+            self.assertGreater(row["gates"], 0)
+            self.assertGreater(row["peak_rss_bytes"], 0)
+            self.assertEqual(sum(row["counts"].values()), 1)
+
+        # the peak RSS is the one of the point, not of what the process did before it
+        import benchmark
+        import psutil
+        memory = b"1" * 2**29
+        del memory
+        rss = psutil.Process().memory_info().rss
+        self.assertLess(benchmark.benchmark_point("add", 1, backend=BasisStateSimulator())["peak_rss_bytes"], rss + 2**28)
+        def allocate():
+            memory = b"1" * 2**28
+            time.sleep(0.05) # the sampling thread runs while the GIL is released
+            return len(memory)
+        for measure in [benchmark._peak_rss_during, benchmark._sampled_peak_rss_during]:
+            rss = psutil.Process().memory_info().rss
+            size, peak_rss = measure(allocate)
+            self.assertEqual(size, 2**28)
+            self.assertGreater(peak_rss, rss + 2**27)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "baseline.json")
+            with open(path, "w") as file:
+                json.dump(report, file)
+            with open(path) as file:
+                baseline = json.load(file)
+
+        self.assertEqual(compare_to_baseline(report, baseline), [])
+
+        baseline["results"][0]["gates"] -= 1
+        baseline["results"][1]["run_s"] = report["results"][1]["run_s"] - 1
+        regressions = compare_to_baseline(report, baseline)
+        self.assertEqual([(function, n, metric) for function, n, _, metric, _, _ in regressions], [("add", 1, "gates"), ("add", 2, "run_s")])
+
+    def test_profiler(self):
+        N, X, Y = "1011", "0111", "101"
+        with Profiler() as profiler:
+            circuit = build_power_Y_core(N, X, Y)
+        unprofiled = build_power_Y_core(N, X, Y)
+        self.assertEqual((circuit.num_qubits, circuit.count_ops()), (unprofiled.num_qubits, unprofiled.count_ops()))
+        self.assertFalse(hasattr(multiply_mod_fixed_power_Y, "__wrapped__"))
+
+        # everything appended under multiply_mod_fixed_power_Y is attributed to exactly one node
+        arithmetic = dict(circuit.count_ops())
+        arithmetic["measure"] -= len(N)
+        if not arithmetic["measure"]:
+            del arithmetic["measure"]
+        root = profiler.root.children["multiply_mod_fixed_power_Y"]
+        self.assertEqual(dict(root.gates), arithmetic)
+        self.assertEqual(root.calls, 1)
+
+        self_gates = Counter()
+        for _, node in profiler.nodes():
+            self_gates.update(node.self_gates())
+        self.assertEqual(dict(self_gates), arithmetic)
+
+        stacks = profiler.collapsed_stacks(metric="ccx")
+        self.assertEqual(sum(int(line.rsplit(" ", 1)[1]) for line in stacks), arithmetic["ccx"])
+        self.assertTrue(all(line.startswith("multiply_mod_fixed_power_Y;") for line in stacks))
+        self.assertTrue(any(line.startswith("multiply_mod_fixed_power_Y;multiply_mod_fixed_power;multiply_mod_fixed;multiply_mod;controlled_add;") for line in stacks))
+        self.assertIn("controlled_full_adder", format_profile(profiler))
+
+    def test_import_has_no_side_effects(self):
+        # importing the library or the demo builds and runs nothing, and does not load qiskit_aer
+        src = os.path.join(os.path.dirname(__file__), '..', 'src')
+        script = "import sys, io, contextlib\n" \
+                 "output = io.StringIO()\n" \
+                 "with contextlib.redirect_stdout(output):\n" \
+                 "    import api, main\n" \
+                 "print(repr(output.getvalue()), 'qiskit_aer' in sys.modules)"
+        result = subprocess.run([sys.executable, "-c", script], cwd=src, capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.split(), ["''", "False"])
+
+    def test_runner(self):
+        import runner
+        jobs = [{"id": "a", "b": "0101", "n": "1011", "x": "0111", "y": "101"},
+                {"b": "0011", "n": "1011", "x": "0010", "y": "11", "adder": "cuccaro", "shots": 3},
+                {"b": "0100", "n": "1011", "x": "0011", "y": "01", "reduction": "montgomery", "gate_library": "low_cost"}]
+
+        with tempfile.TemporaryDirectory() as directory:
+            input_path = os.path.join(directory, "jobs.jsonl")
+            output_path = os.path.join(directory, "results.jsonl")
+            with open(input_path, "w") as file:
+                file.write("\n".join(json.dumps(job) for job in jobs) + "\n\nnot json\n")
+
+            for workers in [1, 2]:
+                self.assertEqual(runner.main([input_path, "--output", output_path, "--workers", str(workers)]), 1)
+                with open(output_path) as file:
+                    rows = sorted((json.loads(line) for line in file), key=lambda row: row["index"])
+
+                self.assertEqual([row["index"] for row in rows], [0, 1, 2, 4])
+                self.assertIn("JSONDecodeError", rows[3]["error"])
+                self.assertEqual(rows[0]["id"], "a")
+                for job, row in zip(jobs, rows):
+                    N, X, B, Y = (int(job[key], 2) for key in ["n", "x", "b", "y"])
+                    expected = reference.multiply_mod_fixed_power_Y(N, X, B, Y, len(job["n"]), reduction=job.get("reduction", "doubling"))
+                    self.assertEqual(row["result"], expected)
+                    self.assertEqual(sum(row["counts"].values()), job.get("shots", 1))
+                    self.assertEqual(row["backend"], "basis_state")
+                    self.assertGreater(row["gates"]["ccx"] + row["gates"].get("mcx", 0), 0)
+
+            for workers in ["0", "-1"]:
+                with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+                    runner.main([input_path, "--workers", workers])
+
+        for key in ["b", "n", "x", "y"]:
+            job = {"b": "01", "n": "11", "x": "10", "y": "01", key: ""}
+            with self.assertRaisesRegex(ValueError, f"line 3: {key} must be a non-empty binary string"):
+                runner.parse_job(json.dumps(job), 2, {})
+
+    def test_registers(self):
+        for value in [6, "110", "0110", [0, 1, 1], np.array([False, True, True, False])]:
+            self.assertEqual(to_int(value), 6)
+        self.assertEqual([register_width(value) for value in [6, 0, "0110", [0, 1, 1]]], [3, 1, 4, 3])
+        self.assertEqual(to_binary(6, 5), "00110")
+        self.assertEqual(to_bits("110", 4).tolist(), [False, True, True, False])
+        self.assertEqual(counts_to_ints([{"0110": 3, "0001": 1}, {"11": 1}]).tolist(), [6, 3])
+        for bad in [lambda: to_binary(6, 2), lambda: to_int(-1), lambda: to_int([0, 2]), lambda: check_width("01", 3), lambda: check_width(8, 3)]:
+            with self.assertRaises(ValueError):
+                bad()
+
+        circuit = QuantumCircuit(4)
+        load_register(circuit=circuit, A=[0, 1, 2, 3], value="1101")
+        self.assertEqual(BasisStateSimulator().run(circuit.measure_all(inplace=False)).result().get_counts(), {"1101": 1})
+
+        # an int, a binary string and a bit array (LSB first) of the same value build the same circuit
+        cores = [build_power_Y_core(N, X, Y) for N, X, Y in [("1011", "0111", "101"), (11, 7, 5), (np.array([1, 1, 0, 1]), [1, 1, 1, 0], [1, 0, 1])]]
+        self.assertEqual(len({(core.num_qubits, tuple(sorted(core.count_ops().items()))) for core in cores}), 1)
+        self.assertEqual(power_Y_key("1011", "0111", "101"), power_Y_key(11, 7, 5))
+
+        backend = BasisStateSimulator()
+        results = run_batch([(b, 11, 7, 5) for b in range(11)] + [("0101", "1011", "0111", "101")], backend)
+        for (b, N, X, Y), result in results.items():
+            self.assertEqual(result, reference.multiply_mod_fixed_power_Y(to_int(N), to_int(X), to_int(b), to_int(Y), 4))
+        with self.assertRaises(ValueError):
+            run_batch([(16, 11, 7, 5)], backend)
+
+    def test_controlled_multiply_mod_fixed_power(self):
+        import order_finding
+        n = 3
+        aux_size = multiply_mod_fixed_power_Y_aux_size(n, reset_free=True, adder="cuccaro", constant=True)
+        for N, X, k in [(7, 3, 0), (7, 3, 1), (5, 2, 2)]:
+            for b in range(N):
+                for control in [0, 1]:
+                    circuit = QuantumCircuit(n + 1 + aux_size, n)
+                    load_register(circuit=circuit, A=range(n), value=b)
+                    if control:
+                        circuit.x(n)
+                    multiply_mod_fixed_power_2_k(circuit=circuit, N=to_binary(N, n), X=X, B=list(range(n)), AUX=list(range(n + 1, n + 1 + aux_size)),
+                                                 k=k, reset_free=True, adder="cuccaro", constant=True, controls=[n])
+                    circuit.measure(range(n), range(n))
+
+                    state, clbits = simulate(circuit)
+                    self.assertEqual(register_values(clbits, range(n))[0], b * pow(X, 2**k, N) % N if control else b)
+                    self.assertEqual(register_values(state, range(n + 1, n + 1 + aux_size))[0], 0)
+
+        with self.assertRaises(ValueError):
+            multiply_mod_fixed_power_2_k(circuit=QuantumCircuit(20), N="111", X=3, B=[0, 1, 2], AUX=list(range(4, 20)), k=0, controls=[3])
+
+        # 7 has order 4 mod 15: y is 0, 4, 8 or 12 out of 2^4
+        counts = backend.run(transpile(order_finding.order_finding_circuit(15, 7, m=4), backend), shots=64, seed_simulator=1).result().get_counts()
+        self.assertEqual(set(int(outcome, 2) for outcome in counts), {0, 4, 8, 12})
+        self.assertEqual(order_finding.order_from_measurement(12, 4, 15), 4)
+        # a multiple of the order comes back down to the order
+        self.assertEqual(order_finding.reduce_order(7, 8, 15), 4)
+        self.assertEqual(order_finding.reduce_order(4, 12, 15), 2)
+        self.assertEqual(order_finding.reduce_order(2, 4 * 9 * 25 * 49, 15), 4)
+        self.assertEqual(order_finding.reduce_order(2, 10 * 97, 11), 10)
+        self.assertEqual(order_finding.reduce_order(1, 6, 15), 1)
+        self.assertEqual(order_finding.find_order(15, 7, backend=backend, shots=16, m=4, seed_simulator=1), 4)
+        self.assertEqual(order_finding.find_order(15, 2, backend=backend, shots=16, m=4, seed_simulator=1), 4)
+        with self.assertRaises(ValueError):
+            order_finding.order_finding_circuit(15, 5)
+
+    def test_semiclassical_order_finding(self):
+        import order_finding
+        full = order_finding.order_finding_circuit(15, 7)
+        semiclassical = order_finding.order_finding_circuit(15, 7, semiclassical=True)
+        self.assertEqual(semiclassical.num_qubits, full.num_qubits - (full.num_clbits - 1))
+        self.assertEqual(semiclassical.num_clbits, full.num_clbits)
+
+        # every shot simulates the whole circuit (mid-circuit measurements), so only a few are run
+        circuit = order_finding.order_finding_circuit(15, 7, m=4, semiclassical=True)
+        counts = backend.run(transpile(circuit, backend), shots=24, seed_simulator=1).result().get_counts()
+        self.assertTrue(set(int(outcome, 2) for outcome in counts) <= {0, 4, 8, 12})
+        self.assertEqual(order_finding.find_order(15, 7, backend=backend, shots=8, m=4, semiclassical=True, seed_simulator=1), 4)
+        self.assertEqual(order_finding.find_order(15, 4, backend=backend, shots=8, m=4, semiclassical=True, seed_simulator=1), 2)
 
 if __name__ == '__main__':
     unittest.main()